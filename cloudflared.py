@@ -12,7 +12,23 @@ import subprocess
 import platform
 import shutil
 import urllib.request
+import urllib.error
+import http.client
+import ssl
 import re
+import json
+import argparse
+import gzip
+import bz2
+import select
+import calendar
+import collections
+import shlex
+import socket
+import hashlib
+import concurrent.futures
+import threading
+import tempfile
 from pathlib import Path
 import stat
 
@@ -22,12 +38,15 @@ if python_version.major < 3 or (python_version.major == 3 and python_version.min
     print("错误: 需要Python 3.5或更高版本")
     sys.exit(1)
 
-# 在Linux系统上检查root权限
-if platform.system() != 'Windows':
-    if os.geteuid() != 0:
+# 不需要本机root权限的子命令
+NO_ROOT_COMMANDS = ('logs', 'fleet')
+
+def require_root():
+    """在Linux系统上检查root权限，没有时退出"""
+    if platform.system() != 'Windows' and os.geteuid() != 0:
         print("\033[31m错误: 此脚本需要root权限运行\033[0m")
         print("\033[33m请使用以下命令重新运行:\033[0m")
-        print("\033[32msudo python3 " + sys.argv[0] + "\033[0m")
+        print("\033[32msudo python3 " + " ".join(shlex.quote(arg) for arg in sys.argv) + "\033[0m")
         sys.exit(1)
 
 # 颜色常量定义
@@ -61,19 +80,360 @@ except SyntaxError:
         except:
             print(message)
 
-def download_file(url, output_path):
-    """下载文件到指定路径"""
+# cloudflared版本及发布地址
+CLOUDFLARED_VERSION = "2024.12.2"
+RELEASE_DOWNLOAD_URL = "https://github.com/cloudflare/cloudflared/releases/download/{version}/{asset}"
+RELEASE_API_URL = "https://api.github.com/repos/cloudflare/cloudflared/releases"
+
+# 快速隧道的公网域名
+TUNNEL_URL_REGEX = r'https://[a-zA-Z0-9-]+\.trycloudflare\.com'
+TUNNEL_URL_PATTERN = re.compile(TUNNEL_URL_REGEX)
+
+def get_asset_name(system=None, arch=None):
+    """获取当前平台对应的cloudflared发布文件名，不支持的平台返回None"""
+    system = system or platform.system()
+    arch = arch or platform.machine()
+    if system == 'Windows':
+        return "cloudflared-windows-amd64.exe"
+    if arch == 'x86_64' or arch == 'amd64':
+        return "cloudflared-linux-amd64"
+    elif arch == 'aarch64' or arch == 'arm64':
+        return "cloudflared-linux-arm64"
+    return None
+
+def get_download_url(version, system=None):
+    """获取指定版本cloudflared的下载地址"""
+    asset = get_asset_name(system)
+    if not asset:
+        return None
+    return RELEASE_DOWNLOAD_URL.format(version=version, asset=asset)
+
+def get_install_paths(system=None):
+    """获取cloudflared的安装目录和二进制文件路径"""
+    if (system or platform.system()) == 'Windows':
+        install_dir = os.path.join(os.environ.get('ProgramData', 'C:\\ProgramData'), 'cloudflared')
+        return install_dir, os.path.join(install_dir, "cloudflared.exe")
+    install_dir = "/usr/local/bin"
+    return install_dir, os.path.join(install_dir, "cloudflared")
+
+def get_cache_dir(system=None):
+    """获取本工具的缓存目录（发布清单等）"""
+    if (system or platform.system()) == 'Windows':
+        return get_install_paths('Windows')[0]
+    return "/var/cache/cloudflared-tool"
+
+# 下载相关的超时和限速配置
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+PROBE_BYTES = 64 * 1024
+PROBE_TIMEOUT = 8
+PROBE_GRACE = 0.5               # 秒，第一个可用源响应后等待其余源的时间
+MIN_THROUGHPUT = 64 * 1024      # 字节/秒，低于此速度时切换到下一个下载源
+THROUGHPUT_WINDOW = 10          # 秒，计算吞吐量的时间窗口
+USER_AGENT = 'cloudflared-tunnel-tool'
+
+def get_download_urls(version, asset=None, primary=None):
+    """按配置的下载源生成候选下载地址
+    
+    环境变量 CLOUDFLARED_MIRRORS 为逗号分隔的地址模板，可使用 {version} 和 {asset}，
+    不含占位符时按 <地址>/<版本>/<文件名> 拼接；GitHub始终作为最后的候选。
+    """
+    asset = asset or get_asset_name()
+    templates = [t.strip() for t in os.environ.get('CLOUDFLARED_MIRRORS', '').split(',') if t.strip()]
+    urls = [primary] if primary else []
+    for template in templates + [RELEASE_DOWNLOAD_URL]:
+        if '{asset}' not in template:
+            template = template.rstrip('/') + '/{version}/{asset}'
+        url = template.format(version=version, asset=asset)
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+class ReadTimeoutMixin:
+    """连接建立（包括代理隧道和TLS握手）后把套接字超时从连接超时改为读取超时"""
+    
+    def __init__(self, *args, read_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_timeout = read_timeout
+    
+    def connect(self):
+        super().connect()
+        if self.read_timeout is not None:
+            self.sock.settimeout(self.read_timeout)
+
+class ReadTimeoutHTTPConnection(ReadTimeoutMixin, http.client.HTTPConnection):
+    pass
+
+class ReadTimeoutHTTPSConnection(ReadTimeoutMixin, http.client.HTTPSConnection):
+    pass
+
+class ReadTimeoutHTTPHandler(urllib.request.HTTPHandler):
+    """urllib只有一个超时参数，用于建立连接；读取超时由连接对象在connect之后设置"""
+    
+    def __init__(self, read_timeout):
+        super().__init__()
+        self.read_timeout = read_timeout
+    
+    def http_open(self, req):
+        return self.do_open(ReadTimeoutHTTPConnection, req, read_timeout=self.read_timeout)
+
+class ReadTimeoutHTTPSHandler(urllib.request.HTTPSHandler):
+    """HTTPS版本的ReadTimeoutHTTPHandler，使用系统默认的证书校验"""
+    
+    def __init__(self, read_timeout):
+        self.ssl_context = ssl.create_default_context()
+        super().__init__(context=self.ssl_context)
+        self.read_timeout = read_timeout
+    
+    def https_open(self, req):
+        return self.do_open(ReadTimeoutHTTPSConnection, req, context=self.ssl_context,
+                            read_timeout=self.read_timeout)
+
+SHA256_PATTERN = re.compile(r'^[0-9a-fA-F]{64}$')
+
+def get_configured_sha256(asset=None):
+    """读取预先给定的SHA256（环境变量 CLOUDFLARED_SHA256 或 --sha256），不需要访问GitHub
+    
+    值为单个SHA256，或逗号分隔的 <文件名>=<SHA256>（用于不同架构的主机），未配置时返回None。
+    """
+    value = os.environ.get('CLOUDFLARED_SHA256', '').strip()
+    if not value:
+        return None
+    asset = asset or get_asset_name()
+    for entry in (e.strip() for e in value.split(',') if e.strip()):
+        name, _, digest = entry.rpartition('=')
+        if not SHA256_PATTERN.match(digest):
+            raise ValueError(f"CLOUDFLARED_SHA256 格式错误: {entry}")
+        if not name or name == asset:
+            return digest.lower()
+    return None
+
+def get_trusted_download_urls(version, expected_sha256=None, primary=None):
+    """只有能用官方SHA256校验下载结果时才使用镜像源，否则只从GitHub下载
+    
+    镜像上的文件未经校验时不能信任，后续还会被执行（--version）。
+    """
+    if expected_sha256:
+        return get_download_urls(version, primary=primary)
+    return [primary or get_download_url(version)]
+
+def build_url_opener(read_timeout=None):
+    """创建URL opener，环境变量 CLOUDFLARED_PROXY 优先于系统的 http(s)_proxy 设置
+    
+    指定read_timeout时，连接建立后的每次读取使用该超时，而不是打开时传入的连接超时。
+    """
+    handlers = []
+    proxy = os.environ.get('CLOUDFLARED_PROXY')
+    if proxy:
+        handlers.append(urllib.request.ProxyHandler({'http': proxy, 'https': proxy}))
+    if read_timeout is not None:
+        handlers.extend([ReadTimeoutHTTPHandler(read_timeout), ReadTimeoutHTTPSHandler(read_timeout)])
+    return urllib.request.build_opener(*handlers)
+
+def open_url(url, start=0, end=None, connect_timeout=None, read_timeout=None):
+    """发起（可选范围的）GET请求，分别设置连接超时和读取超时
+    
+    超时为None时使用调用时的 CONNECT_TIMEOUT / READ_TIMEOUT。
+    """
+    connect_timeout = CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+    read_timeout = READ_TIMEOUT if read_timeout is None else read_timeout
+    headers = {'User-Agent': USER_AGENT}
+    if start or end is not None:
+        headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+    opener = build_url_opener(read_timeout)
+    return opener.open(urllib.request.Request(url, headers=headers), timeout=connect_timeout)
+
+def get_total_size(response):
+    """从Content-Range或Content-Length中取得文件总大小，未知时返回None"""
+    content_range = response.headers.get('Content-Range', '')
+    if '/' in content_range and not content_range.endswith('/*'):
+        return int(content_range.rsplit('/', 1)[1])
+    if response.status == 200 and response.headers.get('Content-Length'):
+        return int(response.headers['Content-Length'])
+    return None
+
+def probe_source(url):
+    """用一个小的范围请求测试下载源，返回耗时、是否支持断点续传和文件大小"""
+    result = {'url': url, 'ok': False, 'elapsed': None, 'ranges': False, 'size': None, 'error': None}
+    start_time = time.time()
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req) as response, open(output_path, 'wb') as out_file:
-            shutil.copyfileobj(response, out_file)
-        return True
+        with open_url(url, 0, PROBE_BYTES - 1, PROBE_TIMEOUT, PROBE_TIMEOUT) as response:
+            response.read(PROBE_BYTES)
+            result['ranges'] = response.status == 206
+            result['size'] = get_total_size(response)
+        result['ok'] = True
     except Exception as e:
-        print_color("下载失败: " + str(e), Colors.RED)
-        return False
+        result['error'] = str(e)
+    result['elapsed'] = time.time() - start_time
+    return result
+
+def race_sources(urls):
+    """并发探测所有下载源，返回按响应速度排序的可用源
+    
+    第一个可用源响应后，其余源只再等待PROBE_GRACE秒；仍未响应的源排在最后作为备选，
+    探测失败的源被丢弃。
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(urls))
+    try:
+        futures = {executor.submit(probe_source, url): url for url in urls}
+        pending = set(futures)
+        results = []
+        deadline = time.time() + PROBE_TIMEOUT
+        while pending and time.time() < deadline:
+            done, pending = concurrent.futures.wait(pending, timeout=deadline - time.time(),
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            results.extend(future.result() for future in done)
+            if any(r['ok'] for r in results):
+                deadline = min(deadline, time.time() + PROBE_GRACE)
+    finally:
+        executor.shutdown(wait=False)
+    ranked = sorted((r for r in results if r['ok']), key=lambda r: r['elapsed'])
+    # 未完成探测的源不知道是否支持断点续传，先按支持处理，服务器返回200时会从头下载
+    ranked.extend({'url': futures[future], 'ranges': True, 'size': None} for future in pending)
+    return ranked
+
+def fetch_to_file(urls, output_path, abort_event=None):
+    """下载文件到指定路径，先写入临时文件再原子替换，失败时抛出异常
+    
+    urls可以是单个地址或多个镜像地址。多个地址时先用范围请求竞速选出最快的源，
+    传输中吞吐量低于下限或读取超时则切换到下一个源，支持断点续传时从已下载位置继续。
+    abort_event被设置后在下一个数据块处中止下载，不再尝试其余下载源。
+    """
+    urls = [urls] if isinstance(urls, str) else list(urls)
+    if len(urls) > 1:
+        sources = race_sources(urls)
+        if not sources:
+            raise Exception("所有下载源均不可用: " + ", ".join(urls))
+    else:
+        sources = [{'url': urls[0], 'ranges': False, 'size': None}]
+    
+    part_path = output_path + ".part"
+    offset = 0
+    errors = []
+    try:
+        with open(part_path, 'wb') as out_file:
+            for index, source in enumerate(sources):
+                has_fallback = index + 1 < len(sources)
+                if abort_event is not None and abort_event.is_set():
+                    raise Exception("下载已取消")
+                if offset and not source['ranges']:
+                    offset = 0
+                out_file.seek(offset)
+                out_file.truncate()
+                try:
+                    with open_url(source['url'], offset) as response:
+                        if offset and response.status != 206:
+                            out_file.seek(0)
+                            out_file.truncate()
+                            offset = 0
+                        total = get_total_size(response)
+                        window_start, window_bytes = time.time(), 0
+                        while True:
+                            if abort_event is not None and abort_event.is_set():
+                                raise Exception("下载已取消")
+                            chunk = response.read(16 * 1024)
+                            if not chunk:
+                                break
+                            out_file.write(chunk)
+                            offset += len(chunk)
+                            window_bytes += len(chunk)
+                            elapsed = time.time() - window_start
+                            if elapsed >= THROUGHPUT_WINDOW:
+                                if has_fallback and window_bytes / elapsed < MIN_THROUGHPUT:
+                                    raise Exception(f"吞吐量过低 ({window_bytes / elapsed / 1024:.1f} KB/s)")
+                                window_start, window_bytes = time.time(), 0
+                    if total is not None and offset != total:
+                        raise Exception(f"下载不完整: {offset}/{total} 字节")
+                    break
+                except Exception as e:
+                    out_file.flush()
+                    errors.append(f"{source['url']}: {str(e)}")
+                    if not has_fallback or (abort_event is not None and abort_event.is_set()):
+                        raise Exception("; ".join(errors))
+        os.replace(part_path, output_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """计算文件的SHA256校验值"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def prepare_binary(urls, bin_path, system, abort_event=None, expected_sha256=None):
+    """后台任务: 从候选下载地址中下载cloudflared、校验SHA256并设置执行权限
+
+    给出expected_sha256时校验不一致的文件会被删除；未给出时只计算校验值，verified为False。
+    在后台线程中运行，不直接打印输出，结果由调用方在汇合时统一显示。
+    """
+    result = {'ok': False, 'error': None, 'sha256': None, 'verified': False, 'size': 0, 'elapsed': 0.0}
+    start_time = time.time()
+    try:
+        fetch_to_file(urls, bin_path, abort_event)
+        result['size'] = os.path.getsize(bin_path)
+        result['sha256'] = file_sha256(bin_path)
+        if expected_sha256:
+            if result['sha256'] != expected_sha256.lower():
+                os.remove(bin_path)
+                raise Exception(f"SHA256不匹配: 期望 {expected_sha256}，实际 {result['sha256']}")
+            result['verified'] = True
+        if system != 'Windows':
+            mode = os.stat(bin_path).st_mode
+            os.chmod(bin_path, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = str(e)
+    result['elapsed'] = time.time() - start_time
+    return result
+
+def prepare_release_binary(version, bin_path, system, abort_event=None):
+    """后台任务: 取得SHA256后下载cloudflared并校验
+    
+    优先使用预先给定的SHA256（CLOUDFLARED_SHA256 / --sha256），其次使用发布清单（优先使用缓存）。
+    """
+    try:
+        expected_sha256 = get_configured_sha256()
+    except ValueError as e:
+        return {'ok': False, 'error': str(e), 'sha256': None, 'verified': False, 'size': 0, 'elapsed': 0.0}
+    if not expected_sha256:
+        try:
+            expected_sha256 = resolve_release_asset(version, quiet=True)[2]
+        except Exception:
+            expected_sha256 = None
+    urls = get_trusted_download_urls(version, expected_sha256)
+    return prepare_binary(urls, bin_path, system, abort_event, expected_sha256)
+
+def parse_origin_address(local_addr):
+    """从本地服务地址中解析出主机和端口"""
+    addr = local_addr.strip()
+    default_port = 443 if addr.startswith('https://') else 80
+    if '://' in addr:
+        addr = addr.split('://', 1)[1]
+    addr = addr.split('/', 1)[0]
+    if addr.startswith('['):
+        host, _, rest = addr[1:].partition(']')
+        port = rest[1:] if rest.startswith(':') else ''
+    elif addr.count(':') == 1:
+        host, port = addr.split(':')
+    else:
+        host, port = addr, ''
+    return host or '127.0.0.1', int(port) if port else default_port
+
+def check_origin(local_addr, timeout=3):
+    """后台任务: 预检本地服务地址是否可以建立TCP连接"""
+    result = {'ok': False, 'error': None, 'elapsed': 0.0}
+    start_time = time.time()
+    try:
+        host, port = parse_origin_address(local_addr)
+        with socket.create_connection((host, port), timeout=timeout):
+            result['ok'] = True
+    except Exception as e:
+        result['error'] = str(e)
+    result['elapsed'] = time.time() - start_time
+    return result
 
 def is_admin():
     """检查是否有管理员权限"""
@@ -81,7 +441,7 @@ def is_admin():
         if platform.system() == 'Windows':
             return ctypes.windll.shell32.IsUserAnAdmin() != 0
         else:
-            # Linux系统下，脚本开头已经检查了root权限，所以这里直接返回True
+            # Linux系统下，cli()入口已经检查了root权限，所以这里直接返回True
             return True
     except:
         return False
@@ -129,10 +489,10 @@ def get_service_status(service_name):
     else:
         return get_service_status_linux(service_name)
 
-def service_exists(service_name):
-    """检查服务是否存在"""
+def inspect_service(service_name):
+    """后台任务: 查询服务是否存在及其状态，只调用一次状态查询"""
     status = get_service_status(service_name)
-    return status != "NOT FOUND"
+    return status != "NOT FOUND", status
 
 def create_service_windows(service_name, bin_path):
     """创建Windows服务"""
@@ -144,41 +504,64 @@ def create_service_windows(service_name, bin_path):
         print_color(f"创建服务失败: {str(e)}", Colors.RED)
         return False
 
-def create_service_linux(service_name, bin_path, local_addr, log_path):
-    """创建Linux systemd服务"""
-    try:
-        # 在Linux环境下默认使用root用户运行服务
-        user = "root"
-        group = "root"
-        
-        # 获取日志文件的绝对路径
-        log_path_abs = os.path.abspath(log_path)
-        log_dir = os.path.dirname(log_path_abs)
-        
-        # 创建服务单元文件
-        service_content = f"""[Unit]
+def build_service_settings(bin_path, local_addr, log_path, extra_args=None):
+    """生成systemd服务中与运行地址和日志相关的[Service]配置项"""
+    log_path_abs = os.path.abspath(log_path)
+    exec_start = f"{bin_path} tunnel --url {local_addr} --logfile {log_path_abs} --no-autoupdate"
+    if extra_args:
+        exec_start += " " + " ".join(shlex.quote(arg) for arg in extra_args)
+    return {
+        'ExecStart': exec_start,
+        'WorkingDirectory': os.path.dirname(log_path_abs),
+        'StandardOutput': f"append:{log_path_abs}",
+        'StandardError': f"append:{log_path_abs}",
+    }
+
+def render_unit(settings, user="root", group="root"):
+    """生成systemd服务单元文件内容"""
+    return f"""[Unit]
 Description=Cloudflare Tunnel
 After=network.target
 
 [Service]
 Type=simple
-ExecStart={bin_path} tunnel --url {local_addr} --logfile {log_path_abs} --no-autoupdate
+ExecStart={settings['ExecStart']}
 Restart=always
 RestartSec=5
 User={user}
 Group={group}
-WorkingDirectory={log_dir}
-StandardOutput=append:{log_path_abs}
-StandardError=append:{log_path_abs}
+WorkingDirectory={settings['WorkingDirectory']}
+StandardOutput={settings['StandardOutput']}
+StandardError={settings['StandardError']}
 
 [Install]
 WantedBy=multi-user.target
 """
-        service_path = f"/etc/systemd/system/{service_name}.service"
+
+def create_service_linux(service_name, bin_path, local_addr, log_path):
+    """创建Linux systemd服务"""
+    try:
+        # 在Linux环境下默认使用root用户运行服务
+        user = "root"
+        group = "root"
+        
+        # 获取日志文件的绝对路径
+        log_path_abs = os.path.abspath(log_path)
+        log_dir = os.path.dirname(log_path_abs)
+        settings = build_service_settings(bin_path, local_addr, log_path)
+        
+        # 创建服务单元文件
+        service_content = render_unit(settings, user, group)
+        service_path = get_unit_path(service_name)
         
         with open(service_path, 'w') as f:
             f.write(service_content)
         
+        # 重新创建时移除reconfigure留下的drop-in，避免其覆盖新配置
+        dropin_path = get_dropin_path(service_name)
+        if os.path.exists(dropin_path):
+            os.remove(dropin_path)
+        
         print_color(f"systemd服务单元创建完成: {service_path}", Colors.GREEN)
         print_color(f"服务将以 {user}:{group} 身份运行", Colors.CYAN)
         print_color(f"日志文件绝对路径: {log_path_abs}", Colors.CYAN)
@@ -225,9 +608,12 @@ def delete_service_linux(service_name):
     """删除Linux服务"""
     try:
         subprocess.run(['systemctl', 'disable', f"{service_name}.service"], check=True)
-        service_path = f"/etc/systemd/system/{service_name}.service"
+        service_path = get_unit_path(service_name)
         if os.path.exists(service_path):
             os.remove(service_path)
+        dropin_path = get_dropin_path(service_name)
+        if os.path.exists(dropin_path):
+            os.remove(dropin_path)
         subprocess.run(['systemctl', 'daemon-reload'], check=True)
         return True
     except Exception as e:
@@ -285,7 +671,6 @@ def get_tunnel_url_from_output(cloudflared_bin, local_addr, timeout=15):
             # 尝试读取输出（非阻塞）
             try:
                 # 检查是否有数据可读
-                import select
                 reads, _, _ = select.select([process.stdout, process.stderr], [], [], 0.5)
                 
                 for stream in reads:
@@ -295,7 +680,7 @@ def get_tunnel_url_from_output(cloudflared_bin, local_addr, timeout=15):
                         
                     # 检查输出中是否包含域名
                     if 'https://' in line and 'trycloudflare.com' in line:
-                        match = re.search(r'https://[a-zA-Z0-9-]+\.trycloudflare\.com', line)
+                        match = TUNNEL_URL_PATTERN.search(line)
                         if match:
                             domain = match.group(0)
                             print_color(f"发现域名: {domain}", Colors.GREEN)
@@ -368,7 +753,7 @@ def get_tunnel_url_from_journalctl(service_name, max_attempts=2):
                 output = result.stdout
                 
                 if 'trycloudflare.com' in output:
-                    match = re.search(r'https://[a-zA-Z0-9-]+\.trycloudflare\.com', output)
+                    match = TUNNEL_URL_PATTERN.search(output)
                     if match:
                         url = match.group(0)
                         print_color(f"从systemd日志中找到URL: {url}", Colors.GREEN)
@@ -420,6 +805,24 @@ def stop_service(service_name):
     else:
         return stop_service_linux(service_name)
 
+def uninstall_service(service_name, log_path):
+    """卸载服务: 停止并删除服务，日志归档而不是删除"""
+    try:
+        if platform.system() != 'Windows':
+            report = teardown_services([service_name])[0]
+            return report['exited'] and not report['error']
+        
+        stop_service(service_name)
+        wait_for_service_state(service_name, "STOPPED")
+        
+        delete_service(service_name)
+        
+        archive_log(log_path)
+        return True
+    except Exception as e:
+        print_color(f"卸载服务错误: {str(e)}", Colors.RED)
+        return False
+
 def set_executable_permission(file_path):
     """为文件设置执行权限并验证权限设置成功"""
     if platform.system() != 'Windows':
@@ -462,6 +865,639 @@ def set_executable_permission(file_path):
             return False
     return True
 
+def load_json_file(path, default=None):
+    """读取JSON文件，文件不存在或内容损坏时返回默认值"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def save_json_file(path, data):
+    """写入JSON文件，先写临时文件再原子替换"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def fetch_release_manifest(version=None, cache_dir=None, timeout=15, quiet=False):
+    """获取cloudflared发布清单，通过ETag/If-None-Match复用本地缓存
+    
+    version为空时获取最新版本；指定版本的发布内容不会变化，命中缓存时不再请求网络。
+    网络不可用时回退到缓存内容。quiet为True时不输出（后台线程中调用）。返回 (release, source)。
+    """
+    url = RELEASE_API_URL + ("/tags/" + version if version else "/latest")
+    cache_path = os.path.join(cache_dir or get_cache_dir(), "release-manifest.json")
+    cache = load_json_file(cache_path, {})
+    entry = cache.get(url)
+    if version and entry:
+        return entry['release'], 'cache'
+    
+    headers = {'Accept': 'application/vnd.github+json', 'User-Agent': USER_AGENT}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        with build_url_opener().open(req, timeout=timeout) as response:
+            data = json.loads(response.read().decode('utf-8'))
+            etag = response.headers.get('ETag')
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and entry:
+            return entry['release'], 'cache'
+        if entry:
+            return entry['release'], 'stale-cache'
+        raise
+    except OSError:
+        if entry:
+            return entry['release'], 'stale-cache'
+        raise
+    
+    release = {
+        'tag_name': data.get('tag_name'),
+        'assets': [{'name': asset.get('name'),
+                    'url': asset.get('browser_download_url'),
+                    'digest': asset.get('digest')} for asset in data.get('assets', [])],
+    }
+    cache[url] = {'etag': etag, 'release': release, 'fetched_at': time.time()}
+    try:
+        save_json_file(cache_path, cache)
+    except OSError as e:
+        if not quiet:
+            print_color(f"写入发布清单缓存失败: {str(e)}", Colors.YELLOW)
+    return release, 'network'
+
+def resolve_release_asset(version=None, cache_dir=None, quiet=False):
+    """确定目标版本，返回 (版本号, 下载地址, SHA256或None, 清单来源)
+    
+    指定了版本且预先给定了SHA256时不访问GitHub API，GitHub不可达时仍可从镜像下载并校验。
+    """
+    asset_name = get_asset_name()
+    if not asset_name:
+        raise Exception(f"不支持的架构: {platform.machine()}")
+    configured_sha256 = get_configured_sha256(asset_name)
+    if version and configured_sha256:
+        return version, get_download_url(version), configured_sha256, 'configured'
+    try:
+        release, source = fetch_release_manifest(version, cache_dir, quiet=quiet)
+    except Exception as e:
+        if not version:
+            raise
+        if not quiet:
+            print_color(f"获取发布清单失败，按版本号直接下载: {str(e)}", Colors.YELLOW)
+        return version, get_download_url(version), None, 'none'
+    for asset in release['assets']:
+        if asset['name'] == asset_name:
+            digest = asset.get('digest') or ''
+            sha256 = digest.split(':', 1)[1].lower() if digest.startswith('sha256:') else None
+            return release['tag_name'], asset['url'], configured_sha256 or sha256, source
+    raise Exception(f"发布 {release['tag_name']} 中没有找到 {asset_name}")
+
+def get_installed_version(bin_path):
+    """运行 cloudflared --version 获取版本号，失败时返回None"""
+    try:
+        result = subprocess.run([bin_path, '--version'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True,
+                                timeout=10)
+        match = re.search(r'version (\S+)', result.stdout + result.stderr)
+        return match.group(1) if match else None
+    except Exception:
+        return None
+
+def stage_binary(url, bin_path, expected_version, expected_sha256=None, system=None):
+    """在旧文件旁边下载并校验新版本，返回 (暂存路径, 错误信息)"""
+    system = system or platform.system()
+    staged_path = bin_path + ".new"
+    urls = get_trusted_download_urls(expected_version, expected_sha256, url)
+    result = prepare_binary(urls, staged_path, system, expected_sha256=expected_sha256)
+    if not result['ok']:
+        return None, "下载失败: " + str(result['error'])
+    
+    staged_version = get_installed_version(staged_path)
+    if staged_version != expected_version:
+        os.remove(staged_path)
+        return None, f"版本校验失败: 期望 {expected_version}，实际 {staged_version}"
+    return staged_path, None
+
+def swap_binary(staged_path, bin_path):
+    """将暂存的新版本原子替换到位，旧版本保留为 .old 用于回滚，返回备份路径"""
+    backup_path = bin_path + ".old"
+    if not os.path.exists(bin_path):
+        os.replace(staged_path, bin_path)
+        return None
+    if os.path.exists(backup_path):
+        os.remove(backup_path)
+    try:
+        # 硬链接不复制数据，正在运行的进程继续使用旧的inode
+        os.link(bin_path, backup_path)
+    except OSError:
+        shutil.copy2(bin_path, backup_path)
+    os.replace(staged_path, bin_path)
+    return backup_path
+
+def rollback_binary(bin_path, backup_path):
+    """用 .old 备份恢复旧版本"""
+    os.replace(backup_path, bin_path)
+
+def get_unit_path(service_name):
+    """获取systemd服务单元文件路径"""
+    return f"/etc/systemd/system/{service_name}.service"
+
+# 本工具管理的drop-in文件名，reconfigure只改写这一个文件
+DROPIN_NAME = "50-cloudflared-tool.conf"
+
+def get_dropin_path(service_name):
+    """获取本工具管理的drop-in文件路径"""
+    return os.path.join(get_unit_path(service_name) + ".d", DROPIN_NAME)
+
+def read_unit_settings(service_name):
+    """读取服务单元及其drop-in合并后生效的[Service]配置项，单元不存在时返回None
+    
+    按systemd的规则依次应用drop-in，空值表示重置该配置项。
+    """
+    unit_path = get_unit_path(service_name)
+    try:
+        with open(unit_path, 'r') as f:
+            contents = [f.read()]
+    except OSError:
+        return None
+    dropin_dir = unit_path + ".d"
+    if os.path.isdir(dropin_dir):
+        for name in sorted(os.listdir(dropin_dir)):
+            if name.endswith('.conf'):
+                with open(os.path.join(dropin_dir, name), 'r') as f:
+                    contents.append(f.read())
+    
+    settings = {}
+    for content in contents:
+        section = None
+        for line in content.splitlines():
+            line = line.strip()
+            if not line or line.startswith(('#', ';')):
+                continue
+            if line.startswith('['):
+                section = line
+            elif section == '[Service]' and '=' in line:
+                key, value = line.split('=', 1)
+                if value:
+                    settings[key.strip()] = value.strip()
+                else:
+                    settings.pop(key.strip(), None)
+    return settings
+
+def read_exec_start(service_name):
+    """读取systemd服务单元的ExecStart命令，返回参数列表，找不到时返回None"""
+    settings = read_unit_settings(service_name)
+    if not settings or not settings.get('ExecStart'):
+        return None
+    return shlex.split(settings['ExecStart'])
+
+def get_option_value(argv, option):
+    """从命令行参数列表中取出选项的值，支持 --opt value 和 --opt=value"""
+    for i, arg in enumerate(argv):
+        if arg == option and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith(option + '='):
+            return arg[len(option) + 1:]
+    return None
+
+def remove_options(argv, options):
+    """从命令行参数列表中移除带值的选项"""
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        if arg in options:
+            skip = True
+            continue
+        if any(arg.startswith(option + '=') for option in options):
+            continue
+        result.append(arg)
+    return result
+
+def set_option_value(argv, option, value):
+    """在命令行参数列表中替换选项的值，其余参数保持原样；选项不存在时插入到tunnel子命令之后"""
+    result = list(argv)
+    for i, arg in enumerate(result):
+        if arg == option and i + 1 < len(result):
+            result[i + 1] = value
+            return result
+        if arg.startswith(option + '='):
+            result[i] = f"{option}={value}"
+            return result
+    insert_at = result.index('tunnel') + 1 if 'tunnel' in result else len(result)
+    result[insert_at:insert_at] = [option, value]
+    return result
+
+def build_reconfigured_settings(argv, local_addr=None, log_path=None):
+    """在现有ExecStart中只替换 --url/--logfile 的值，生成新的[Service]配置项
+    
+    profile等其余参数原样保留；有日志文件时同时更新工作目录和标准输出的位置。
+    """
+    if local_addr:
+        argv = set_option_value(argv, '--url', local_addr)
+    log_path = log_path or get_option_value(argv, '--logfile')
+    settings = {}
+    if log_path:
+        log_path_abs = os.path.abspath(log_path)
+        argv = set_option_value(argv, '--logfile', log_path_abs)
+        settings.update({
+            'WorkingDirectory': os.path.dirname(log_path_abs),
+            'StandardOutput': f"append:{log_path_abs}",
+            'StandardError': f"append:{log_path_abs}",
+        })
+    settings['ExecStart'] = " ".join(shlex.quote(arg) for arg in argv)
+    return settings
+
+def settings_differ(current, key, value):
+    """比较配置项是否变化，ExecStart按解析后的参数比较，不受引号写法影响"""
+    if key == 'ExecStart':
+        try:
+            return shlex.split(current.get(key) or '') != shlex.split(value)
+        except ValueError:
+            return True
+    return current.get(key) != value
+
+def is_named_tunnel(argv):
+    """判断ExecStart是否运行命名隧道（快速隧道使用 --url 且每次启动都会更换域名）"""
+    return bool(argv) and '--url' not in argv and ('run' in argv[1:] or '--token' in argv)
+
+def find_free_port():
+    """获取一个本地空闲端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def probe_metrics_ready(port, timeout=2):
+    """请求一次cloudflared的 /ready 接口，至少注册了一条连接时返回True"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=timeout) as response:
+            return response.status == 200
+    except (OSError, ValueError):
+        return False
+
+def wait_for_metrics_ready(port, timeout=60):
+    """轮询cloudflared的 /ready 接口，至少注册一条连接后返回就绪时间，超时返回None"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if probe_metrics_ready(port):
+            return time.time()
+        time.sleep(0.2)
+    return None
+
+class ReadinessMonitor:
+    """在后台线程中持续轮询 /ready 接口，记录每次探测的时间和结果"""
+    
+    def __init__(self, port, interval=0.2):
+        self.port = port
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._first_sample = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        """启动轮询线程，拿到第一个样本后返回，保证之后的区间都有起始状态"""
+        self._thread.start()
+        self._first_sample.wait()
+    
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stop_event.is_set():
+            probed_at = time.time()
+            self.samples.append((probed_at, probe_metrics_ready(self.port)))
+            self._first_sample.set()
+            self._stop_event.wait(max(0.0, self.interval - (time.time() - probed_at)))
+    
+    def unready_time(self, start, end):
+        """统计 [start, end] 内探测为未就绪的总时长
+        
+        每次探测的结果一直有效到下一次探测；区间开始前和区间内都没有样本时无法判断，返回None。
+        """
+        samples = [sample for sample in self.samples if sample[0] <= end]
+        if not samples:
+            return None
+        total = 0.0
+        for index, (probed_at, ready) in enumerate(samples):
+            until = samples[index + 1][0] if index + 1 < len(samples) else end
+            if not ready:
+                total += max(0.0, min(until, end) - max(probed_at, start))
+        if samples[0][0] > start:
+            # 区间开始到第一次探测之间的状态未知
+            return None
+        return total
+
+def format_gap(gap):
+    """格式化不可用时长，无法测量时显示为未知"""
+    return "未知" if gap is None else f"{gap:.2f} 秒"
+
+def wait_for_registration(service_name, log_path, offset, since, timeout=60):
+    """等待服务在指定时间点后注册隧道连接，返回就绪时间，超时返回None
+    
+    有日志文件时只读取offset之后新增的内容，否则查询systemd日志。
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if log_path and os.path.exists(log_path):
+                if os.path.getsize(log_path) < offset:
+                    offset = 0  # 日志被截断或轮转
+                with open(log_path, 'r', errors='ignore') as f:
+                    f.seek(offset)
+                    text = f.read()
+            else:
+                text = subprocess.run(
+                    ['journalctl', '-u', f"{service_name}.service", '--since', '@%d' % int(since),
+                     '-o', 'cat', '--no-pager'],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    universal_newlines=True,
+                    timeout=5
+                ).stdout
+            if 'Registered tunnel connection' in text:
+                return time.time()
+        except Exception:
+            pass
+        time.sleep(0.3)
+    return None
+
+def restart_unit(service_name, argv, timeout):
+    """重启服务并等待重新注册连接，返回 (重启时间, 就绪时间)，超时时就绪时间为None"""
+    log_path = get_option_value(argv, '--logfile') if argv else None
+    offset = os.path.getsize(log_path) if log_path and os.path.exists(log_path) else 0
+    restart_at = time.time()
+    subprocess.run(['systemctl', 'restart', f"{service_name}.service"], check=True)
+    return restart_at, wait_for_registration(service_name, log_path, offset, restart_at, timeout)
+
+def restart_and_wait(service_name, argv, timeout):
+    """重启服务并等待重新注册连接，返回 (是否就绪, 不可用时长)"""
+    restart_at, ready_at = restart_unit(service_name, argv, timeout)
+    if ready_at is None:
+        return False, None
+    return True, ready_at - restart_at
+
+def restart_with_overlap(service_name, argv, bin_path, timeout, grace_period):
+    """命名隧道的重叠重启: 先启动新版本的临时实例并等待就绪，再重启原服务
+    
+    原实例收到SIGTERM后按其grace period排空连接，期间由临时实例承载流量；
+    原服务重新就绪后再以 --grace-period 停止临时实例。返回 (是否就绪, 不可用时长)。
+    重启期间持续探测临时实例的 /ready，不可用时长为临时实例未就绪且原服务尚未重新注册的时间，
+    无法测量时为None。
+    """
+    port = find_free_port()
+    bridge_unit = f"{service_name}-upgrade-bridge"
+    bridge_argv = remove_options(argv, ['--metrics', '--grace-period', '--logfile', '--pidfile'])
+    bridge_argv[0] = bin_path
+    insert_at = bridge_argv.index('tunnel') + 1 if 'tunnel' in bridge_argv else 1
+    bridge_argv[insert_at:insert_at] = ['--metrics', f"127.0.0.1:{port}", '--grace-period', grace_period]
+    
+    print_color(f"启动临时实例 {bridge_unit} (metrics端口 {port})...", Colors.CYAN)
+    try:
+        subprocess.run(['systemd-run', '--unit=' + bridge_unit, '--collect', '--quiet'] + bridge_argv,
+                       check=True)
+    except Exception as e:
+        print_color(f"启动临时实例失败，改为直接重启: {str(e)}", Colors.YELLOW)
+        return restart_and_wait(service_name, argv, timeout)
+    
+    try:
+        bridge_ready_at = wait_for_metrics_ready(port, timeout)
+        if bridge_ready_at is None:
+            print_color("临时实例未能就绪，改为直接重启", Colors.YELLOW)
+            return restart_and_wait(service_name, argv, timeout)
+        print_color("临时实例已就绪，重启原服务...", Colors.GREEN)
+        monitor = ReadinessMonitor(port)
+        monitor.start()
+        try:
+            restart_at, ready_at = restart_unit(service_name, argv, timeout)
+        finally:
+            monitor.stop()
+        if ready_at is None:
+            return False, None
+        return True, monitor.unready_time(restart_at, ready_at)
+    finally:
+        print_color(f"排空并停止临时实例 {bridge_unit}...", Colors.CYAN)
+        subprocess.run(['systemctl', 'stop', bridge_unit], check=False)
+
+def wait_for_service_state(service_name, state, timeout=30):
+    """等待服务进入指定状态"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if get_service_status(service_name) == state:
+            return True
+        time.sleep(0.5)
+    return False
+
+def render_dropin(settings):
+    """生成drop-in文件内容，ExecStart需要先置空再重新设置"""
+    lines = ["# 由 cloudflared.py reconfigure 生成，请勿手动修改", "[Service]"]
+    for key, value in sorted(settings.items()):
+        if key == 'ExecStart':
+            lines.append("ExecStart=")
+        lines.append(f"{key}={value}")
+    return "\n".join(lines) + "\n"
+
+def write_file_if_changed(path, content):
+    """内容不同时才原子写入文件，返回是否发生了写入"""
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+def reconfigure_service_linux(service_name, local_addr=None, log_path=None, config_source=None,
+                              timeout=60, grace_period='30s'):
+    """就地修改现有服务，只改写变化的drop-in，按需daemon-reload和重启
+    
+    local_addr/log_path为空时沿用当前配置；config_source为新的ingress配置文件，
+    会覆盖到ExecStart中 --config 指向的位置。返回包含变更内容和耗时的字典。
+    """
+    result = {'ok': False, 'changed': [], 'restarted': False, 'control_time': 0.0, 'outage': None}
+    start_time = time.time()
+    current = read_unit_settings(service_name)
+    argv = read_exec_start(service_name)
+    if not current or not argv:
+        print_color(f"服务 {service_name} 不存在或无法解析ExecStart", Colors.RED)
+        return result
+    
+    unit_changed = False
+    if local_addr or log_path:
+        if is_named_tunnel(argv):
+            print_color("命名隧道的源站由ingress配置决定，请使用 --config 修改", Colors.RED)
+            return result
+        desired = build_reconfigured_settings(argv, local_addr, log_path)
+        changed_keys = [key for key, value in desired.items() if settings_differ(current, key, value)]
+        if changed_keys:
+            # drop-in总是包含全部受管配置项，内容不变时不会重写
+            unit_changed = write_file_if_changed(get_dropin_path(service_name), render_dropin(desired))
+            result['changed'].extend(changed_keys)
+    
+    config_changed = False
+    if config_source:
+        config_target = get_option_value(argv, '--config')
+        if not config_target:
+            print_color("当前服务未使用 --config，无法更新ingress配置", Colors.RED)
+            return result
+        with open(config_source, 'r') as f:
+            config_changed = write_file_if_changed(config_target, f.read())
+        if config_changed:
+            result['changed'].append('ingress')
+    
+    if unit_changed:
+        subprocess.run(['systemctl', 'daemon-reload'], check=True)
+        argv = read_exec_start(service_name)
+    result['control_time'] = time.time() - start_time
+    
+    if not result['changed']:
+        result['ok'] = True
+        return result
+    
+    if get_service_status(service_name) != "RUNNING":
+        # 服务未运行时只更新配置，不主动启动
+        result['ok'] = True
+        return result
+    
+    # cloudflared不支持热加载本地ingress配置，命名隧道通过重叠重启避免中断
+    if is_named_tunnel(argv):
+        ready, outage = restart_with_overlap(service_name, argv, argv[0], timeout, grace_period)
+    else:
+        ready, outage = restart_and_wait(service_name, argv, timeout)
+    result['restarted'] = True
+    result['outage'] = outage
+    result['ok'] = ready
+    return result
+
+def reconfigure_service_windows(service_name, bin_path, local_addr, log_path):
+    """修改Windows服务的启动命令并重启服务"""
+    try:
+        service_command = f'"{bin_path}" tunnel --url {local_addr} --logfile "{log_path}"'
+        subprocess.run(['sc', 'config', service_name, 'binPath=', service_command], check=True)
+        stop_service(service_name)
+        wait_for_service_state(service_name, "STOPPED")
+        return start_service(service_name)
+    except Exception as e:
+        print_color(f"修改服务失败: {str(e)}", Colors.RED)
+        return False
+
+def print_reconfigure_result(service_name, result):
+    """显示reconfigure的结果"""
+    if not result['changed']:
+        print_color(f"服务 {service_name} 配置无变化，未执行任何操作 "
+                    f"({result['control_time'] * 1000:.0f} 毫秒)", Colors.GREEN)
+        return
+    print_color(f"已更新: {', '.join(result['changed'])}，"
+                f"控制面耗时 {result['control_time'] * 1000:.0f} 毫秒", Colors.GREEN)
+    if result['restarted']:
+        if result['ok']:
+            print_color(f"服务已重新就绪，不可用时长: {format_gap(result['outage'])}", Colors.GREEN)
+        else:
+            print_color("服务重启后未能在超时时间内就绪", Colors.RED)
+    else:
+        print_color("服务未运行，配置将在下次启动时生效", Colors.YELLOW)
+
+def reconfigure_command(args):
+    """reconfigure命令: 就地修改现有服务"""
+    if not (args.url or args.log or args.config):
+        print_color("请至少指定 --url、--log 或 --config 之一", Colors.RED)
+        return 1
+    if platform.system() == 'Windows':
+        if not args.url:
+            print_color("Windows下只支持修改 --url", Colors.RED)
+            return 1
+        install_dir, bin_path = get_install_paths('Windows')
+        log_path = args.log or os.path.join(install_dir, "cloudflared.log")
+        return 0 if reconfigure_service_windows(args.service, bin_path, args.url, log_path) else 1
+    
+    result = reconfigure_service_linux(args.service, args.url, args.log, args.config,
+                                       args.timeout, args.grace_period)
+    if not result['ok'] and not result['changed']:
+        return 1
+    print_reconfigure_result(args.service, result)
+    return 0 if result['ok'] else 1
+
+def upgrade_command(args):
+    """upgrade命令: 无中断升级cloudflared二进制文件"""
+    system = platform.system()
+    install_dir, bin_path = get_install_paths(system)
+    os.makedirs(install_dir, exist_ok=True)
+    
+    try:
+        version, url, sha256, source = resolve_release_asset(args.version, args.cache_dir)
+    except Exception as e:
+        print_color(f"无法确定目标版本: {str(e)}", Colors.RED)
+        return 1
+    current = get_installed_version(bin_path) if os.path.exists(bin_path) else None
+    print_color(f"当前版本: {current or '未安装'}，目标版本: {version} (清单来源: {source})", Colors.CYAN)
+    if current == version and not args.force:
+        print_color("已是目标版本，无需升级", Colors.GREEN)
+        return 0
+    
+    print_color(f"下载并校验新版本: {url}", Colors.YELLOW)
+    if not sha256 and os.environ.get('CLOUDFLARED_MIRRORS'):
+        print_color("发布清单中没有SHA256，无法校验镜像文件，只从GitHub下载", Colors.YELLOW)
+    staged_path, error = stage_binary(url, bin_path, version, sha256, system)
+    if error:
+        print_color(error, Colors.RED)
+        return 1
+    print_color("新版本校验通过" + ("（SHA256已验证）" if sha256 else ""), Colors.GREEN)
+    
+    services = [name for name in (args.service or ['cloudflared'])
+                if get_service_status(name) == "RUNNING"]
+    
+    if system == 'Windows':
+        # Windows无法替换正在运行的可执行文件，只能停止后替换
+        for name in services:
+            stop_service(name)
+            wait_for_service_state(name, "STOPPED")
+        stopped_at = time.time()
+        backup_path = swap_binary(staged_path, bin_path)
+        for name in services:
+            start_service(name)
+        if services:
+            print_color(f"服务中断时长: {time.time() - stopped_at:.1f} 秒", Colors.CYAN)
+        print_color(f"已升级到 {version}", Colors.GREEN)
+        return 0
+    
+    backup_path = swap_binary(staged_path, bin_path)
+    print_color(f"已原子替换 {bin_path}" + (f"，旧版本备份: {backup_path}" if backup_path else ""), Colors.GREEN)
+    
+    for index, name in enumerate(services):
+        argv = read_exec_start(name)
+        if is_named_tunnel(argv):
+            print_color(f"\n升级命名隧道服务 {name}（重叠重启）...", Colors.CYAN)
+            ready, gap = restart_with_overlap(name, argv, bin_path, args.timeout, args.grace_period)
+        else:
+            print_color(f"\n升级快速隧道服务 {name}，重启后trycloudflare域名会改变", Colors.YELLOW)
+            ready, gap = restart_and_wait(name, argv, args.timeout)
+        
+        if not ready:
+            print_color(f"服务 {name} 在 {args.timeout} 秒内未能就绪，回滚到旧版本", Colors.RED)
+            if backup_path:
+                rollback_binary(bin_path, backup_path)
+                # 只重启已经切换到新版本的服务（包括失败的这个），后面的服务仍在运行旧版本，
+                # 无需重启，快速隧道也不会因此丢失trycloudflare域名
+                for restored in services[:index + 1]:
+                    subprocess.run(['systemctl', 'restart', f"{restored}.service"], check=False)
+                print_color(f"已回滚到 {current}", Colors.YELLOW)
+            return 1
+        print_color(f"服务 {name} 已就绪，不可用时长: {format_gap(gap)}", Colors.GREEN)
+    
+    print_color(f"\n已升级到 {version}", Colors.GREEN)
+    return 0
+
 def main():
     print_color("====== CloudFlared Tunnel 设置工具 ======", Colors.CYAN)
     print_color("初始化中...", Colors.YELLOW)
@@ -474,27 +1510,19 @@ def main():
     current_dir = os.getcwd()
     
     # 设置变量
+    install_dir, cloudflared_bin = get_install_paths(system)
     if system == 'Windows':
-        cloudflared_url = "https://github.com/cloudflare/cloudflared/releases/download/2024.12.2/cloudflared-windows-amd64.exe"
-        install_dir = os.path.join(os.environ.get('ProgramData', 'C:\\ProgramData'), 'cloudflared')
-        cloudflared_bin = os.path.join(install_dir, "cloudflared.exe")
+        cloudflared_url = get_download_url(CLOUDFLARED_VERSION, system)
         log_path = os.path.join(install_dir, "cloudflared.log")
     else:  # Linux
         # Linux下已确保使用root权限运行
         print_color("已确认拥有root权限", Colors.GREEN)
         
-        arch = platform.machine()
-        if arch == 'x86_64' or arch == 'amd64':
-            cloudflared_url = "https://github.com/cloudflare/cloudflared/releases/download/2024.12.2/cloudflared-linux-amd64"
-        elif arch == 'aarch64' or arch == 'arm64':
-            cloudflared_url = "https://github.com/cloudflare/cloudflared/releases/download/2024.12.2/cloudflared-linux-arm64"
-        else:
-            print_color(f"不支持的架构: {arch}", Colors.RED)
+        cloudflared_url = get_download_url(CLOUDFLARED_VERSION, system)
+        if not cloudflared_url:
+            print_color(f"不支持的架构: {platform.machine()}", Colors.RED)
             sys.exit(1)
         
-        install_dir = "/usr/local/bin"
-        cloudflared_bin = os.path.join(install_dir, "cloudflared")
-        
         # 在Linux环境下默认使用当前目录存放日志
         log_path = os.path.join(current_dir, "cloudflared.log")
         print_color("将使用当前目录保存日志文件", Colors.CYAN)
@@ -502,33 +1530,6 @@ def main():
     service_name = "cloudflared"
     
     print_color(f"检测到Python版本: {platform.python_version()}", Colors.GREEN)
-    print_color(f"日志文件路径: {log_path}", Colors.CYAN)
-    
-    # Linux环境下提供日志路径选择
-    if system != 'Windows':
-        print_color("\n选择日志文件保存位置:", Colors.YELLOW)
-        print("1) 当前目录 (默认): " + log_path)
-        print("2) 用户主目录: ~/.cloudflared/cloudflared.log")
-        print("3) 系统日志目录: /var/log/cloudflared.log")
-        
-        log_choice = input("请选择 (直接回车使用当前目录): ")
-        
-        if log_choice == "2":
-            home_dir = os.path.expanduser("~")
-            log_dir = os.path.join(home_dir, ".cloudflared")
-            if not os.path.exists(log_dir):
-                try:
-                    os.makedirs(log_dir, exist_ok=True)
-                except Exception as e:
-                    print_color("无法创建日志目录: " + str(e), Colors.RED)
-            log_path = os.path.join(log_dir, "cloudflared.log")
-            print_color("日志将保存到: " + log_path, Colors.CYAN)
-        elif log_choice == "3":
-            log_path = "/var/log/cloudflared.log"
-            print_color("日志将保存到: " + log_path, Colors.CYAN)
-        else:
-            # 默认使用当前目录
-            print_color("将使用当前目录: " + log_path, Colors.CYAN)
     
     # 创建安装目录
     try:
@@ -540,104 +1541,152 @@ def main():
         print_color(f"错误: {str(e)}", Colors.RED)
         sys.exit(1)
     
-    # 检查cloudflared是否存在
-    print_color("\n检查cloudflared...", Colors.YELLOW)
-    if os.path.exists(cloudflared_bin):
-        print_color(f"cloudflared已存在: {cloudflared_bin}", Colors.GREEN)
+    # 下载、校验和服务状态查询互不依赖，立即在后台启动，
+    # 交互提示与之并行进行，只在真正需要结果的地方汇合
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    download_abort = threading.Event()
+    download_future = service_future = uninstall_future = preflight_future = None
+    try:
+        print_color("\n检查cloudflared...", Colors.YELLOW)
+        if os.path.exists(cloudflared_bin):
+            print_color(f"cloudflared已存在: {cloudflared_bin}", Colors.GREEN)
+        else:
+            print_color("在后台下载cloudflared，期间可继续完成配置...", Colors.CYAN)
+            print_color(f"下载URL: {cloudflared_url}", Colors.WHITE)
+            print_color(f"保存位置: {cloudflared_bin}", Colors.WHITE)
+            download_urls = get_download_urls(CLOUDFLARED_VERSION)
+            if len(download_urls) > 1:
+                print_color(f"已配置 {len(download_urls)} 个下载源，能获取官方SHA256时从中选择最快的", Colors.WHITE)
+            download_future = executor.submit(prepare_release_binary, CLOUDFLARED_VERSION, cloudflared_bin,
+                                              system, download_abort)
+        service_future = executor.submit(inspect_service, service_name)
+    
+        print_color(f"日志文件路径: {log_path}", Colors.CYAN)
+    
+        # Linux环境下提供日志路径选择
+        if system != 'Windows':
+            print_color("\n选择日志文件保存位置:", Colors.YELLOW)
+            print("1) 当前目录 (默认): " + log_path)
+            print("2) 用户主目录: ~/.cloudflared/cloudflared.log")
+            print("3) 系统日志目录: /var/log/cloudflared.log")
         
+            log_choice = input("请选择 (直接回车使用当前目录): ")
+        
+            if log_choice == "2":
+                home_dir = os.path.expanduser("~")
+                log_dir = os.path.join(home_dir, ".cloudflared")
+                if not os.path.exists(log_dir):
+                    try:
+                        os.makedirs(log_dir, exist_ok=True)
+                    except Exception as e:
+                        print_color("无法创建日志目录: " + str(e), Colors.RED)
+                log_path = os.path.join(log_dir, "cloudflared.log")
+                print_color("日志将保存到: " + log_path, Colors.CYAN)
+            elif log_choice == "3":
+                log_path = "/var/log/cloudflared.log"
+                print_color("日志将保存到: " + log_path, Colors.CYAN)
+            else:
+                # 默认使用当前目录
+                print_color("将使用当前目录: " + log_path, Colors.CYAN)
+    
+        # 检查现有服务（汇合服务状态查询）
+        print_color("\n检查现有服务...", Colors.YELLOW)
+        uninstall_future = None
+        keep_existing = False
         try:
-            file_size = os.path.getsize(cloudflared_bin) / (1024 * 1024)
-            print_color(f"文件大小: {file_size:.2f} MB", Colors.CYAN)
+            exists, service_status = service_future.result()
+            if exists:
+                print_color(f"检测到现有cloudflared服务: {service_name}", Colors.YELLOW)
+                print_color(f"服务状态: {service_status}", Colors.CYAN)
             
-            # 即使文件已存在，也确保它有执行权限（Linux）
-            if system != 'Windows':
-                # 检查是否有执行权限
-                if not os.access(cloudflared_bin, os.X_OK):
-                    print_color("现有的cloudflared文件没有执行权限，正在设置...", Colors.YELLOW)
-                    set_executable_permission(cloudflared_bin)
+                uninstall = ""
+                while uninstall.lower() not in ['y', 'yes', 'n', 'no']:
+                    uninstall = input("是否要卸载旧服务？(y/n): ")
+            
+                if uninstall.lower() in ['y', 'yes']:
+                    print_color("在后台卸载旧服务...", Colors.CYAN)
+                    uninstall_future = executor.submit(uninstall_service, service_name, log_path)
                 else:
-                    print_color("cloudflared已有执行权限", Colors.GREEN)
+                    print_color("保留现有服务，仅更新运行地址", Colors.YELLOW)
+                    keep_existing = True
         except Exception as e:
-            print_color(f"检查文件时出错: {str(e)}", Colors.RED)
-    else:
-        print_color("开始下载cloudflared...", Colors.CYAN)
-        print_color(f"下载URL: {cloudflared_url}", Colors.WHITE)
-        print_color(f"保存位置: {cloudflared_bin}", Colors.WHITE)
-        
-        download_success = download_file(cloudflared_url, cloudflared_bin)
-        
-        if download_success:
-            print_color("下载完成！", Colors.GREEN)
+            print_color(f"检查服务错误: {str(e)}", Colors.RED)
+    
+        # 选择运行模式
+        print_color("\n请选择运行模式:", Colors.YELLOW)
+        print("1) 临时运行 (前台运行并显示trycloudflare域名)")
+        print("2) 后台运行 (注册为系统服务)")
+    
+        mode = ""
+        while mode not in ['1', '2']:
+            mode = input("请输入1或2: ")
+    
+        local_addr = ""
+        while not local_addr:
+            local_addr = input("请输入本地服务地址 (例如: 127.0.0.1:8080): ")
+    
+        # 本地服务预检只依赖地址，与下载的剩余部分并行
+        preflight_future = executor.submit(check_origin, local_addr)
+    
+        # 汇合下载任务，后续步骤都需要可执行的cloudflared
+        if download_future is not None:
+            if not download_future.done():
+                print_color("\n等待cloudflared下载完成...", Colors.YELLOW)
+            download_result = download_future.result()
+            if download_result['ok']:
+                print_color(f"下载完成！耗时 {download_result['elapsed']:.1f} 秒", Colors.GREEN)
+                print_color(f"文件大小: {download_result['size'] / (1024 * 1024):.2f} MB", Colors.CYAN)
+                if download_result['verified']:
+                    print_color(f"SHA256校验通过: {download_result['sha256']}", Colors.GREEN)
+                else:
+                    print_color("警告: 未能从发布清单获取官方SHA256，文件未经校验", Colors.YELLOW)
+                    print_color(f"SHA256: {download_result['sha256']}", Colors.CYAN)
+            else:
+                print_color("下载失败: " + str(download_result['error']), Colors.RED)
+                print_color("下载失败，请检查网络连接或手动下载", Colors.RED)
+                print_color(f"手动下载URL: {cloudflared_url}", Colors.YELLOW)
+                sys.exit(1)
+        else:
             try:
-                # 为Linux系统设置可执行权限
-                if system != 'Windows':
-                    set_executable_permission(cloudflared_bin)
-                
                 file_size = os.path.getsize(cloudflared_bin) / (1024 * 1024)
                 print_color(f"文件大小: {file_size:.2f} MB", Colors.CYAN)
             except Exception as e:
-                print_color(f"设置权限错误: {str(e)}", Colors.RED)
-        else:
-            print_color("下载失败，请检查网络连接或手动下载", Colors.RED)
-            print_color(f"手动下载URL: {cloudflared_url}", Colors.YELLOW)
-            sys.exit(1)
+                print_color(f"检查文件时出错: {str(e)}", Colors.RED)
     
-    # 如果在Linux上，确保二进制文件可以执行
-    if system != 'Windows':
-        print_color("\n验证cloudflared是否可执行...", Colors.YELLOW)
-        if os.access(cloudflared_bin, os.X_OK):
-            print_color("cloudflared已有执行权限", Colors.GREEN)
-        else:
-            print_color("警告: cloudflared没有执行权限，尝试设置...", Colors.RED)
-            if not set_executable_permission(cloudflared_bin):
-                print_color("错误: 无法设置执行权限，请手动执行:", Colors.RED)
-                print_color(f"chmod +x {cloudflared_bin}", Colors.WHITE)
-                if input("是否继续? (y/n): ").lower() not in ['y', 'yes']:
-                    sys.exit(1)
-    
-    # 检查现有服务
-    print_color("\n检查现有服务...", Colors.YELLOW)
-    try:
-        if service_exists(service_name):
-            service_status = get_service_status(service_name)
-            print_color(f"检测到现有cloudflared服务: {service_name}", Colors.YELLOW)
-            print_color(f"服务状态: {service_status}", Colors.CYAN)
-            
-            uninstall = ""
-            while uninstall.lower() not in ['y', 'yes', 'n', 'no']:
-                uninstall = input("是否要卸载旧服务？(y/n): ")
-            
-            if uninstall.lower() in ['y', 'yes']:
-                print_color("卸载旧服务...", Colors.CYAN)
-                try:
-                    stop_service(service_name)
-                    time.sleep(2)
-                    
-                    delete_service(service_name)
-                    
-                    if os.path.exists(log_path):
-                        os.remove(log_path)
-                    
-                    print_color("服务卸载完成", Colors.GREEN)
-                except Exception as e:
-                    print_color(f"卸载服务错误: {str(e)}", Colors.RED)
+        # 如果在Linux上，确保二进制文件可以执行
+        if system != 'Windows':
+            print_color("\n验证cloudflared是否可执行...", Colors.YELLOW)
+            if os.access(cloudflared_bin, os.X_OK):
+                print_color("cloudflared已有执行权限", Colors.GREEN)
             else:
-                print_color("保留现有服务，仅更新运行地址", Colors.YELLOW)
-    except Exception as e:
-        print_color(f"检查服务错误: {str(e)}", Colors.RED)
-    
-    # 选择运行模式
-    print_color("\n请选择运行模式:", Colors.YELLOW)
-    print("1) 临时运行 (前台运行并显示trycloudflare域名)")
-    print("2) 后台运行 (注册为系统服务)")
+                print_color("警告: cloudflared没有执行权限，尝试设置...", Colors.RED)
+                if not set_executable_permission(cloudflared_bin):
+                    print_color("错误: 无法设置执行权限，请手动执行:", Colors.RED)
+                    print_color(f"chmod +x {cloudflared_bin}", Colors.WHITE)
+                    if input("是否继续? (y/n): ").lower() not in ['y', 'yes']:
+                        sys.exit(1)
     
-    mode = ""
-    while mode not in ['1', '2']:
-        mode = input("请输入1或2: ")
+        # 汇合卸载任务，创建新服务前旧服务必须已被移除
+        if uninstall_future is not None:
+            if uninstall_future.result():
+                print_color("服务卸载完成", Colors.GREEN)
+            else:
+                print_color("卸载服务时出现错误，继续执行", Colors.RED)
     
-    local_addr = ""
-    while not local_addr:
-        local_addr = input("请输入本地服务地址 (例如: 127.0.0.1:8080): ")
+        preflight = preflight_future.result()
+        if preflight['ok']:
+            print_color(f"本地服务 {local_addr} 可以连接", Colors.GREEN)
+        else:
+            print_color(f"警告: 无法连接本地服务 {local_addr}: {preflight['error']}", Colors.YELLOW)
+            print_color("隧道仍会创建，但在本地服务启动前访问将返回错误", Colors.YELLOW)
+    finally:
+        # 正常流程到这里后台任务均已汇合；Ctrl+C或输入结束(EOF)时通知下载线程中止，
+        # 并取消尚未开始的任务，避免非守护的工作线程拖住进程退出
+        download_abort.set()
+        for future in (download_future, service_future, uninstall_future, preflight_future):
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=False)
     
     if mode == "1":
         print_color("\n以临时模式运行cloudflared...", Colors.CYAN)
@@ -661,7 +1710,10 @@ def main():
             print_color("如果失败，请以管理员身份运行此脚本", Colors.YELLOW)
         
         try:
-            if system == 'Windows':
+            log_offset = 0
+            if system == 'Windows' and keep_existing:
+                success = reconfigure_service_windows(service_name, cloudflared_bin, local_addr, log_path)
+            elif system == 'Windows':
                 service_command = f'"{cloudflared_bin}" tunnel --url {local_addr} --logfile "{log_path}"'
                 success = create_service(service_name, service_command)
             else:
@@ -716,8 +1768,18 @@ def main():
                 else:
                     print_color("跳过临时域名获取，直接创建服务", Colors.YELLOW)
                 
-                print_color(f"创建systemd服务，日志输出到: {log_path}", Colors.CYAN)
-                success = create_service(service_name, cloudflared_bin, local_addr, log_path)
+                # 只在本次启动后新增的日志中查找域名，避免读到旧的地址
+                if os.path.exists(log_path):
+                    log_offset = os.path.getsize(log_path)
+                
+                if keep_existing:
+                    print_color("就地更新现有服务...", Colors.CYAN)
+                    result = reconfigure_service_linux(service_name, local_addr, log_path)
+                    print_reconfigure_result(service_name, result)
+                    success = result['ok']
+                else:
+                    print_color(f"创建systemd服务，日志输出到: {log_path}", Colors.CYAN)
+                    success = create_service(service_name, cloudflared_bin, local_addr, log_path)
             
             if success:
                 print_color("服务创建成功", Colors.GREEN)
@@ -738,6 +1800,7 @@ def main():
                     if os.path.exists(log_path):
                         try:
                             with open(log_path, 'r', errors='ignore') as f:
+                                f.seek(log_offset)
                                 log_content = f.read()
                             
                             # 调试日志文件内容
@@ -748,7 +1811,7 @@ def main():
                                     print_color("日志文件内容(前200字符):", Colors.CYAN)
                                     print(log_content[:200] + "..." if len(log_content) > 200 else log_content)
                             
-                            match = re.search(r'https://[a-zA-Z0-9-]+\.trycloudflare\.com', log_content)
+                            match = TUNNEL_URL_PATTERN.search(log_content)
                             if match:
                                 domain = match.group(0)
                                 print_color("\n=== 服务运行成功 ===", Colors.GREEN)
@@ -825,7 +1888,9 @@ def main():
                             
                             try:    
                                 print_color("\n验证cloudflared进程:", Colors.CYAN)
-                                subprocess.run(["ps", "-ef", "|", "grep", "cloudflared"], shell=True)
+                                sampler = ResourceSampler([service_name])
+                                sampler.sample_once()
+                                print_resource_table(sampler.snapshot())
                             except Exception as e:
                                 print_color(f"获取进程信息失败: {str(e)}", Colors.RED)
                     except Exception as e:
@@ -868,5 +1933,1249 @@ def main():
     
     print_color("\n脚本执行完成", Colors.GREEN)
 
+def wait_for_pid_exit(pid, timeout, pidfd=None):
+    """等待进程退出，优先使用pidfd，不支持时轮询，返回进程是否已退出"""
+    if pid <= 0:
+        return True
+    if pidfd is not None:
+        readable, _, _ = select.select([pidfd], [], [], timeout)
+        return bool(readable)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        time.sleep(0.05)
+    return False
+
+def archive_log(log_path, compress=False):
+    """将日志重命名为带时间戳的归档文件，可选gzip压缩，返回归档路径"""
+    if not log_path or not os.path.exists(log_path):
+        return None
+    archive_path = f"{log_path}.{time.strftime('%Y%m%d-%H%M%S')}"
+    os.replace(log_path, archive_path)
+    if compress:
+        with open(archive_path, 'rb') as src, gzip.open(archive_path + ".gz", 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(archive_path)
+        archive_path += ".gz"
+    return archive_path
+
+def teardown_services(names, archive=True, compress=False, timeout=90, parallel=16, reload=True,
+                      kill_timeout=10):
+    """批量卸载服务
+    
+    一次systemctl调用并行停止所有服务，通过MainPID等待进程真正退出而不是固定sleep；
+    超时仍未退出的服务发送SIGKILL后再等待kill_timeout秒，依然未退出的服务不删除、不归档日志。
+    已退出的服务统一disable、删除单元文件并只执行一次daemon-reload，最后归档日志。
+    返回每个服务的结果字典列表。
+    """
+    start_time = time.time()
+    states = query_unit_states(names)
+    reports = {}
+    pidfds = {}
+    for name in names:
+        pid = int(states.get(name, {}).get('MainPID', '0') or 0)
+        argv = read_exec_start(name) or []
+        reports[name] = {'name': name, 'pid': pid, 'exited': pid <= 0, 'killed': False, 'stop_time': 0.0,
+                         'log': get_option_value(argv, '--logfile'), 'archive': None, 'error': None}
+        # 在发出停止命令前打开pidfd，避免PID被复用
+        if pid > 0 and hasattr(os, 'pidfd_open'):
+            try:
+                pidfds[name] = os.pidfd_open(pid)
+            except ProcessLookupError:
+                reports[name]['exited'] = True
+            except OSError:
+                pass
+    
+    units = [f"{name}.service" for name in names]
+    stop_at = time.time()
+    subprocess.run(['systemctl', 'stop', '--no-block'] + units, check=False)
+    
+    def wait_exit(name, wait_timeout):
+        report = reports[name]
+        if not report['exited']:
+            report['exited'] = wait_for_pid_exit(report['pid'], wait_timeout, pidfds.get(name))
+        report['stop_time'] = time.time() - stop_at
+    
+    def wait_all(wait_names, wait_timeout):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(parallel, len(wait_names)))) as executor:
+            list(executor.map(lambda name: wait_exit(name, wait_timeout), wait_names))
+    
+    try:
+        wait_all(names, timeout)
+        stuck = [name for name in names if not reports[name]['exited']]
+        if stuck:
+            # 进程仍在运行时删除单元文件或归档日志会丢失它之后写入的内容，先强制结束
+            subprocess.run(['systemctl', 'kill', '--signal=SIGKILL'] + [f"{name}.service" for name in stuck],
+                           check=False)
+            for name in stuck:
+                reports[name]['killed'] = True
+            wait_all(stuck, kill_timeout)
+    finally:
+        for fd in pidfds.values():
+            os.close(fd)
+    
+    for name in names:
+        if not reports[name]['exited']:
+            reports[name]['error'] = "进程未退出，未卸载"
+    names = [name for name in names if reports[name]['exited']]
+    units = [f"{name}.service" for name in names]
+    if units:
+        subprocess.run(['systemctl', 'disable', '--quiet'] + units, check=False)
+    for name in names:
+        try:
+            for path in (get_unit_path(name), get_dropin_path(name)):
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError as e:
+            reports[name]['error'] = str(e)
+    if reload:
+        subprocess.run(['systemctl', 'daemon-reload'], check=False)
+    
+    if archive:
+        for report in reports.values():
+            if not report['exited']:
+                continue
+            try:
+                report['archive'] = archive_log(report['log'], compress)
+            except OSError as e:
+                report['error'] = str(e)
+    for report in reports.values():
+        report['total_time'] = time.time() - start_time
+    return list(reports.values())
+
+def print_teardown_reports(reports):
+    """显示每个服务的卸载结果"""
+    for report in reports:
+        if report['error']:
+            color, status = Colors.RED, "错误: " + report['error']
+        elif report['killed']:
+            color, status = Colors.YELLOW, "等待进程退出超时，已强制结束并卸载"
+        else:
+            color, status = Colors.GREEN, "已卸载"
+        print_color(f"{report['name']}: {status}，进程退出耗时 {report['stop_time']:.2f} 秒", color)
+        if report['archive']:
+            print_color(f"  日志已归档: {report['archive']}", Colors.CYAN)
+
+def teardown_command(args):
+    """teardown命令: 并行卸载一个或多个服务"""
+    if platform.system() == 'Windows':
+        failed = [name for name in args.names if not uninstall_service(name, None)]
+        return 1 if failed else 0
+    names = list(args.names)
+    if args.all:
+        names.extend(name for name in sorted(list_managed_units(get_install_paths()[1])) if name not in names)
+    if not names:
+        print_color("请指定服务名称或使用 --all", Colors.RED)
+        return 1
+    start_time = time.time()
+    reports = teardown_services(names, archive=not args.no_archive, compress=args.compress,
+                                timeout=args.timeout, parallel=args.parallel)
+    print_teardown_reports(reports)
+    removed = sum(1 for r in reports if r['exited'])
+    print_color(f"共卸载 {removed}/{len(reports)} 个服务，总耗时 {time.time() - start_time:.2f} 秒",
+                Colors.GREEN if removed == len(reports) else Colors.YELLOW)
+    return 0 if all(r['exited'] and not r['error'] for r in reports) else 1
+
+# 期望状态中的服务名会拼进单元文件路径和systemctl参数，不能包含路径分隔符或以 . - 开头；
+# origin和log直接写入ExecStart/StandardOutput，不能含空白、引号、反斜杠或systemd的 % $ 展开符；
+# profile参数经shlex转义，但仍不能含换行等控制字符或 % $
+INSTANCE_NAME_PATTERN = re.compile(r'^[A-Za-z0-9@_][A-Za-z0-9@._-]*$')
+UNSAFE_VALUE_PATTERN = re.compile(r'[\s"\'\\%$\x00-\x1f\x7f]')
+UNSAFE_ARG_PATTERN = re.compile(r'[%$\x00-\x1f\x7f]')
+
+def load_desired_state(path):
+    """读取期望状态文件并补全默认值
+    
+    文件格式(JSON):
+    {
+        "version": "2024.12.2",
+        "profiles": {"http2": {"args": ["--protocol", "http2"]}},
+        "instances": [
+            {"name": "cloudflared-web", "origin": "127.0.0.1:8080",
+             "log": "/var/log/cloudflared-web.log", "profile": "http2"}
+        ]
+    }
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    profiles = data.get('profiles', {})
+    instances = {}
+    for item in data.get('instances', []):
+        name = item.get('name')
+        if not name or not item.get('origin'):
+            raise ValueError(f"实例缺少name或origin: {item}")
+        if not isinstance(name, str) or not INSTANCE_NAME_PATTERN.match(name):
+            raise ValueError(f"实例名称不合法: {name!r}")
+        if name in instances:
+            raise ValueError(f"实例名称重复: {name}")
+        profile = item.get('profile')
+        if profile and profile not in profiles:
+            raise ValueError(f"实例 {name} 引用了不存在的profile: {profile}")
+        origin = item['origin']
+        log_path = item.get('log') or f"/var/log/{name}.log"
+        for field, value in (('origin', origin), ('log', log_path)):
+            if not isinstance(value, str) or UNSAFE_VALUE_PATTERN.search(value):
+                raise ValueError(f"实例 {name} 的{field}含有不允许的字符: {value!r}")
+        if not os.path.isabs(log_path):
+            raise ValueError(f"实例 {name} 的log必须是绝对路径: {log_path}")
+        extra_args = list(profiles[profile].get('args', [])) if profile else []
+        for arg in extra_args:
+            if not isinstance(arg, str) or UNSAFE_ARG_PATTERN.search(arg):
+                raise ValueError(f"profile {profile} 的参数含有不允许的字符: {arg!r}")
+        instances[name] = {
+            'origin': origin,
+            'log': log_path,
+            'args': extra_args,
+        }
+    return {'version': data.get('version'), 'instances': instances}
+
+def query_unit_states(unit_names):
+    """一次systemctl调用查询多个服务的运行状态和启用状态"""
+    if not unit_names:
+        return {}
+    args = ['systemctl', 'show', '-p', 'Id', '-p', 'ActiveState', '-p', 'UnitFileState', '-p', 'MainPID']
+    result = subprocess.run(args + [f"{name}.service" for name in unit_names],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=False)
+    states = {}
+    for block in result.stdout.strip().split('\n\n'):
+        fields = dict(line.split('=', 1) for line in block.splitlines() if '=' in line)
+        unit_id = fields.get('Id', '')
+        if unit_id.endswith('.service'):
+            states[unit_id[:-len('.service')]] = fields
+    return states
+
+def list_managed_units(bin_path):
+    """列出 /etc/systemd/system 下使用本工具cloudflared运行隧道的服务及其生效配置"""
+    unit_dir = os.path.dirname(get_unit_path('x'))
+    units = {}
+    try:
+        names = os.listdir(unit_dir)
+    except OSError:
+        return units
+    for filename in names:
+        if not filename.endswith('.service'):
+            continue
+        name = filename[:-len('.service')]
+        settings = read_unit_settings(name)
+        if settings and settings.get('ExecStart', '').startswith(bin_path + " tunnel"):
+            units[name] = settings
+    return units
+
+def inspect_binary(bin_path, cache_dir=None):
+    """获取已安装二进制文件的版本和SHA256
+    
+    结果按文件大小和修改时间缓存，文件未变化时不启动进程也不重新计算哈希。
+    """
+    try:
+        st = os.stat(bin_path)
+    except OSError:
+        return None
+    cache_path = os.path.join(cache_dir or get_cache_dir(), "binary-state.json")
+    cached = load_json_file(cache_path, {})
+    if (cached.get('path') == bin_path and cached.get('size') == st.st_size
+            and cached.get('mtime_ns') == st.st_mtime_ns):
+        return cached
+    info = {
+        'path': bin_path,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha256': file_sha256(bin_path),
+        'version': get_installed_version(bin_path),
+    }
+    try:
+        save_json_file(cache_path, info)
+    except OSError:
+        pass
+    return info
+
+def plan_reconcile(desired, bin_path, cache_dir=None):
+    """比较期望状态和实际状态，生成最小操作计划
+    
+    返回操作列表，每项为 (操作, 服务名, 详情)，操作包括
+    upgrade、create、update、delete、enable、start、restart。
+    """
+    plan = []
+    binary = inspect_binary(bin_path, cache_dir)
+    upgrading = bool(desired['version']) and (binary is None or binary.get('version') != desired['version'])
+    if upgrading:
+        plan.append(('upgrade', None, desired['version']))
+    
+    actual = list_managed_units(bin_path)
+    states = query_unit_states(sorted(set(actual) | set(desired['instances'])))
+    for name, instance in sorted(desired['instances'].items()):
+        settings = build_service_settings(bin_path, instance['origin'], instance['log'], instance['args'])
+        state = states.get(name, {})
+        if name not in actual:
+            if os.path.exists(get_unit_path(name)):
+                raise Exception(f"{get_unit_path(name)} 已存在但不是由本工具管理的隧道服务，拒绝覆盖")
+            plan.append(('create', name, settings))
+            plan.append(('enable', name, None))
+            plan.append(('start', name, None))
+            continue
+        changed = [key for key, value in settings.items() if actual[name].get(key) != value]
+        if changed:
+            plan.append(('update', name, settings))
+        if state.get('UnitFileState') != 'enabled':
+            plan.append(('enable', name, None))
+        if state.get('ActiveState') != 'active':
+            plan.append(('start', name, None))
+        elif changed or upgrading:
+            plan.append(('restart', name, None))
+    
+    for name in sorted(set(actual) - set(desired['instances'])):
+        plan.append(('delete', name, None))
+    return plan
+
+def apply_reconcile(plan, bin_path, parallel=4, prune=False, cache_dir=None):
+    """执行操作计划: 先集中写入单元文件并只执行一次daemon-reload，再并发启动服务"""
+    results = []
+    units_written = False
+    
+    for action, name, detail in plan:
+        if action == 'upgrade':
+            version, url, sha256, _ = resolve_release_asset(detail, cache_dir)
+            staged_path, error = stage_binary(url, bin_path, version, sha256)
+            if error:
+                raise Exception(error)
+            swap_binary(staged_path, bin_path)
+            results.append((action, version, True))
+        elif action == 'create':
+            write_file_if_changed(get_unit_path(name), render_unit(detail))
+            units_written = True
+            results.append((action, name, True))
+        elif action == 'update':
+            write_file_if_changed(get_dropin_path(name), render_dropin(detail))
+            units_written = True
+            results.append((action, name, True))
+    
+    to_delete = [name for action, name, _ in plan if action == 'delete'] if prune else []
+    if to_delete:
+        # daemon-reload与上面的单元文件写入合并为一次
+        for report in teardown_services(to_delete, parallel=parallel, reload=False):
+            results.append(('delete', report['name'], report['exited'] and not report['error']))
+        units_written = True
+    
+    if units_written:
+        subprocess.run(['systemctl', 'daemon-reload'], check=True)
+    
+    to_enable = [f"{name}.service" for action, name, _ in plan if action == 'enable']
+    if to_enable:
+        ok = subprocess.run(['systemctl', 'enable'] + to_enable, check=False).returncode == 0
+        results.extend(('enable', unit[:-len('.service')], ok) for unit in to_enable)
+    
+    def run_unit_action(action, name):
+        result = subprocess.run(['systemctl', action, f"{name}.service"],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True,
+                                check=False)
+        return action, name, result.returncode == 0
+    
+    unit_actions = [(action, name) for action, name, _ in plan if action in ('start', 'restart')]
+    if unit_actions:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+            futures = [executor.submit(run_unit_action, action, name) for action, name in unit_actions]
+            for future in concurrent.futures.as_completed(futures):
+                results.append(future.result())
+    return results
+
+def reconcile_command(args):
+    """reconcile命令: 将本机隧道收敛到期望状态"""
+    if platform.system() == 'Windows':
+        print_color("reconcile仅支持Linux systemd", Colors.RED)
+        return 1
+    start_time = time.time()
+    try:
+        desired = load_desired_state(args.file)
+    except Exception as e:
+        print_color(f"读取期望状态失败: {str(e)}", Colors.RED)
+        return 1
+    bin_path = get_install_paths()[1]
+    try:
+        plan = plan_reconcile(desired, bin_path, args.cache_dir)
+    except Exception as e:
+        print_color(f"生成操作计划失败: {str(e)}", Colors.RED)
+        return 1
+    
+    if not plan:
+        print_color(f"已处于期望状态，无需任何操作 ({(time.time() - start_time) * 1000:.0f} 毫秒)",
+                    Colors.GREEN)
+        return 0
+    
+    print_color("操作计划:", Colors.CYAN)
+    for action, name, detail in plan:
+        note = "" if action != 'delete' or args.prune else " (未指定 --prune，跳过)"
+        target = name if name else detail
+        print_color(f"  {action:8s} {target}{note}", Colors.YELLOW if note else Colors.WHITE)
+    if args.dry_run:
+        print_color("dry-run模式，未执行任何操作", Colors.CYAN)
+        return 0
+    
+    try:
+        results = apply_reconcile(plan, bin_path, args.parallel, args.prune, args.cache_dir)
+    except Exception as e:
+        print_color(f"执行计划失败: {str(e)}", Colors.RED)
+        return 1
+    failed = [(action, name) for action, name, ok in results if not ok]
+    for action, name in failed:
+        print_color(f"失败: {action} {name}", Colors.RED)
+    print_color(f"完成 {len(results) - len(failed)}/{len(results)} 项操作，"
+                f"耗时 {time.time() - start_time:.2f} 秒", Colors.GREEN if not failed else Colors.YELLOW)
+    return 1 if failed else 0
+
+# cloudflared日志事件，所有关注的事件合并为一个预编译的正则，每行只匹配一次。
+# 事件文本只在消息开头（控制台格式的级别之后、JSON格式的message/error字段）尝试匹配，
+# 避免在每个字符位置上尝试所有分支。
+LOG_EVENT_PATTERN = re.compile((
+    r'(?:^(?:\S+ )?[A-Z]{3} +(?:error=")?|"message":"|"error":"|error=")(?:'
+    r'\|\s+(?P<url>' + TUNNEL_URL_REGEX + r')'
+    r'|(?P<registered>Registered tunnel connection)'
+    r'|(?P<unregistered>Unregistered tunnel connection)'
+    r'|(?P<retry>Retrying connection in)'
+    r'|(?P<fallback>Switching to fallback protocol)'
+    r'|(?P<origin_error>Unable to reach the origin service)'
+    r'|(?P<conn_error>Serve tunnel error|Connection terminated)'
+    r'|(?P<start>Starting tunnel|Requesting new quick Tunnel)'
+    r'|(?P<shutdown>Initiating graceful shutdown))'
+).encode())
+LOG_ATTR_PATTERN = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|\S+)')
+
+def parse_log_timestamp(line):
+    """解析 2024-12-10T08:00:00Z 格式的时间戳（控制台格式在行首，JSON格式在time字段），
+    返回Unix时间，无法解析时返回None"""
+    if line.startswith('{'):
+        pos = line.find('"time":"')
+        if pos < 0:
+            return None
+        line = line[pos + len('"time":"'):]
+    if len(line) < 19 or line[4:5] != '-' or line[10:11] != 'T':
+        return None
+    try:
+        return calendar.timegm((int(line[0:4]), int(line[5:7]), int(line[8:10]),
+                                int(line[11:13]), int(line[14:16]), int(line[17:19]), 0, 0, 0))
+    except ValueError:
+        return None
+
+def parse_log_attrs(line):
+    """解析日志行中的字段，支持控制台的 key=value 格式和 --logfile 的JSON格式"""
+    if line.startswith('{'):
+        try:
+            return {key: str(value) for key, value in json.loads(line).items()}
+        except ValueError:
+            return {}
+    return dict(LOG_ATTR_PATTERN.findall(line))
+
+def open_log_segment(path):
+    """以二进制方式打开日志分段，自动识别gzip/bz2压缩"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+def find_log_segments(log_path):
+    """查找日志及其轮转、归档分段（含压缩文件），按时间从旧到新排序"""
+    directory = os.path.dirname(os.path.abspath(log_path))
+    prefix = os.path.basename(log_path) + "."
+    segments = []
+    try:
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and not name.endswith(('.part', '.tmp')):
+                segments.append(os.path.join(directory, name))
+    except OSError:
+        pass
+    segments.sort(key=lambda path: os.path.getmtime(path))
+    if os.path.exists(log_path):
+        segments.append(log_path)
+    return segments
+
+def iter_log_lines(paths):
+    """逐行读取多个日志分段，内存占用与文件大小无关，也可以传入已打开的二进制流"""
+    for path in paths:
+        if not isinstance(path, str):
+            yield from path
+            continue
+        try:
+            with open_log_segment(path) as f:
+                for line in f:
+                    yield line
+        except (OSError, EOFError) as e:
+            print_color(f"读取日志 {path} 失败: {str(e)}", Colors.YELLOW)
+
+def follow_log_lines(path, poll_interval=0.5):
+    """持续读取日志新增内容（类似 tail -f），日志被轮转或截断时重新打开
+    
+    没有新内容时产出None，调用方可借此定期输出统计。
+    """
+    f = None
+    inode = None
+    try:
+        while True:
+            if f is None:
+                try:
+                    f = open(path, 'rb')
+                    inode = os.fstat(f.fileno()).st_ino
+                    f.seek(0, os.SEEK_END)
+                except OSError:
+                    f = None
+                    time.sleep(poll_interval)
+                    yield None
+                    continue
+            line = f.readline()
+            if line:
+                yield line
+                continue
+            try:
+                st = os.stat(path)
+                if st.st_ino != inode or st.st_size < f.tell():
+                    f.close()
+                    f = open(path, 'rb')
+                    inode = os.fstat(f.fileno()).st_ino
+                    continue
+            except OSError:
+                pass
+            time.sleep(poll_interval)
+            yield None
+    finally:
+        if f is not None:
+            f.close()
+
+def iter_log_events(lines):
+    """从日志行中提取事件，产出 (时间戳, 事件类型, 行内容)
+    
+    在字节层面匹配，只有命中事件的行才会解码和解析时间戳。
+    输入中的None（跟踪模式下的空闲信号）会原样产出为 (None, None, None)。
+    """
+    search = LOG_EVENT_PATTERN.search
+    for raw in lines:
+        if raw is None:
+            yield None, None, None
+            continue
+        match = search(raw)
+        if match is None:
+            continue
+        line = raw.decode('utf-8', 'replace').rstrip()
+        yield parse_log_timestamp(line), match.lastgroup, line
+
+class TunnelLogStats:
+    """单个隧道的日志统计，只保存计数器，内存占用固定"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.url = None
+        self.first_ts = None
+        self.last_ts = None
+        self.running_since = None
+        self.uptime = 0.0
+        self.counts = collections.Counter()
+        self.colos = collections.Counter()
+        self.protocols = collections.Counter()
+        self.reconnects = 0
+        self.last_registration = None
+        self.registration_gap_total = 0.0
+        self.registration_gaps = 0
+        self.segment_connections = set()
+        self.pending = {}
+    
+    def _is_duplicate(self, ts, kind, line):
+        """判断事件是否是另一种格式中同一事件的重复
+        
+        默认生成的服务把 --logfile 的JSON行和控制台格式的标准输出写入同一个文件，
+        每个事件会出现两次。按 (时间戳, 事件类型, connIndex) 在两种格式之间一一配对，
+        配对成功的那一行视为重复；只有一种格式的日志不受影响。
+        """
+        if ts is None:
+            return False
+        fmt, other = ('json', 'console') if line.startswith('{') else ('console', 'json')
+        for old_ts in [t for t in self.pending if t < ts - 2]:
+            del self.pending[old_ts]
+        key = (kind, parse_log_attrs(line).get('connIndex') if 'connIndex' in line else None)
+        bucket = self.pending.setdefault(ts, {'json': collections.Counter(), 'console': collections.Counter()})
+        if bucket[other][key]:
+            bucket[other][key] -= 1
+            return True
+        bucket[fmt][key] += 1
+        return False
+    
+    def _close_segment(self, end_ts):
+        if self.running_since is not None and end_ts is not None:
+            self.uptime += max(0.0, end_ts - self.running_since)
+        self.running_since = None
+        self.segment_connections = set()
+    
+    def add(self, ts, kind, line):
+        """累加一个事件，两种日志格式重复记录的同一事件只计一次"""
+        if kind == 'origin_error' and 'Request failed' in line:
+            # 同一个失败请求先以带cfRay的源站错误记录一次，再以 "Request failed" 汇总一次，
+            # JSON格式的汇总行也会在error字段中命中，只统计前者
+            return
+        if self._is_duplicate(ts, kind, line):
+            return
+        self.counts[kind] += 1
+        if ts is not None:
+            if self.first_ts is None:
+                self.first_ts = ts
+            if self.running_since is None and kind != 'shutdown':
+                self.running_since = ts
+        
+        if kind == 'url':
+            self.url = TUNNEL_URL_PATTERN.search(line).group(0)
+        elif kind == 'start':
+            # 上一次运行没有正常退出时，以最后一条事件作为结束时间
+            self._close_segment(self.last_ts)
+            self.running_since = ts
+        elif kind == 'shutdown':
+            self._close_segment(ts)
+        elif kind == 'registered':
+            attrs = parse_log_attrs(line)
+            location = attrs.get('location')
+            if location:
+                self.colos[re.sub(r'\d+$', '', location).upper()] += 1
+            if attrs.get('protocol'):
+                self.protocols[attrs['protocol']] += 1
+            conn_index = attrs.get('connIndex')
+            if conn_index in self.segment_connections:
+                self.reconnects += 1
+            self.segment_connections.add(conn_index)
+            if ts is not None:
+                if self.last_registration is not None:
+                    self.registration_gap_total += ts - self.last_registration
+                    self.registration_gaps += 1
+                self.last_registration = ts
+        
+        if ts is not None:
+            self.last_ts = ts
+    
+    def summary(self):
+        """生成可序列化为JSON的统计摘要"""
+        uptime = self.uptime
+        if self.running_since is not None and self.last_ts is not None:
+            uptime += max(0.0, self.last_ts - self.running_since)
+        hours = uptime / 3600 if uptime > 0 else None
+        return {
+            'name': self.name,
+            'url': self.url,
+            'first_seen': self.first_ts,
+            'last_seen': self.last_ts,
+            'uptime_seconds': round(uptime, 1),
+            'starts': self.counts['start'],
+            'registrations': self.counts['registered'],
+            'reconnects': self.reconnects,
+            'reconnects_per_hour': round(self.reconnects / hours, 3) if hours else None,
+            'mean_seconds_between_registrations': (
+                round(self.registration_gap_total / self.registration_gaps, 1)
+                if self.registration_gaps else None),
+            'retries': self.counts['retry'],
+            'protocol_fallbacks': self.counts['fallback'],
+            'connection_errors': self.counts['conn_error'],
+            'origin_errors': self.counts['origin_error'],
+            'origin_errors_per_hour': round(self.counts['origin_error'] / hours, 3) if hours else None,
+            'colos': dict(self.colos.most_common()),
+            'protocols': dict(self.protocols),
+        }
+
+def analyze_log(name, paths):
+    """单次遍历日志分段，返回该隧道的统计摘要"""
+    stats = TunnelLogStats(name)
+    for ts, kind, line in iter_log_events(iter_log_lines(paths)):
+        stats.add(ts, kind, line)
+    return stats.summary()
+
+def print_log_summary(summary):
+    """以易读的形式显示统计摘要"""
+    def fmt(value, suffix=""):
+        return "-" if value is None else f"{value}{suffix}"
+    print_color(f"\n=== {summary['name']} ===", Colors.CYAN)
+    if summary['url']:
+        print_color(f"公网域名: {summary['url']}", Colors.GREEN)
+    print(f"运行时长: {summary['uptime_seconds'] / 3600:.2f} 小时，启动 {summary['starts']} 次")
+    print(f"连接注册: {summary['registrations']} 次，重连 {summary['reconnects']} 次 "
+          f"({fmt(summary['reconnects_per_hour'], '/小时')})，"
+          f"平均注册间隔 {fmt(summary['mean_seconds_between_registrations'], ' 秒')}")
+    print(f"重试: {summary['retries']}，协议回退: {summary['protocol_fallbacks']}，"
+          f"连接错误: {summary['connection_errors']}")
+    print(f"源站错误: {summary['origin_errors']} ({fmt(summary['origin_errors_per_hour'], '/小时')})")
+    if summary['colos']:
+        print("边缘节点: " + ", ".join(f"{colo}={count}" for colo, count in summary['colos'].items()))
+
+def logs_command(args):
+    """logs命令: 统计cloudflared日志中的连接、重连、边缘节点和源站错误"""
+    sources = [(path, path) for path in args.paths]
+    if args.service or not sources:
+        names = [args.service] if args.service else sorted(list_managed_units(get_install_paths()[1]))
+        for name in names:
+            log_path = get_option_value(read_exec_start(name) or [], '--logfile')
+            if log_path:
+                sources.append((name, log_path))
+            else:
+                print_color(f"服务 {name} 未配置 --logfile，跳过", Colors.YELLOW)
+    if not sources:
+        print_color("没有找到可分析的日志", Colors.RED)
+        return 1
+    
+    if args.follow:
+        name, path = sources[0]
+        stats = TunnelLogStats(name)
+        lines = sys.stdin.buffer if path == '-' else follow_log_lines(path)
+        last_report = time.time()
+        try:
+            for ts, kind, line in iter_log_events(lines):
+                if kind is not None:
+                    stats.add(ts, kind, line)
+                if time.time() - last_report >= args.interval:
+                    last_report = time.time()
+                    if args.json:
+                        print(json.dumps(stats.summary(), ensure_ascii=False), flush=True)
+                    else:
+                        print_log_summary(stats.summary())
+        except KeyboardInterrupt:
+            pass
+        return 0
+    
+    summaries = []
+    for name, path in sources:
+        if path == '-':
+            paths = [sys.stdin.buffer]
+        else:
+            paths = find_log_segments(path) if args.rotated else [path]
+        summaries.append(analyze_log(name, paths))
+    if args.json:
+        print(json.dumps(summaries, ensure_ascii=False, indent=2))
+    else:
+        for summary in summaries:
+            print_log_summary(summary)
+    return 0
+
+# /proc/<pid>/stat 中的时间以时钟滴答计
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+def read_proc_sample(pid):
+    """读取 /proc/<pid>/{stat,status,io,fd} 中的资源数据，进程不存在时返回None"""
+    base = f"/proc/{pid}"
+    try:
+        with open(base + "/stat", 'rb') as f:
+            data = f.read()
+        # 进程名可能包含空格和括号，从最后一个右括号之后开始按字段拆分
+        fields = data[data.rindex(b')') + 2:].split()
+        sample = {
+            'time': time.time(),
+            'cpu_ticks': int(fields[11]) + int(fields[12]),
+            'threads': int(fields[17]),
+            'start_ticks': int(fields[19]),
+            'rss': None,
+            'read_bytes': None,
+            'write_bytes': None,
+        }
+        with open(base + "/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    sample['rss'] = int(line.split()[1]) * 1024
+                    break
+        try:
+            with open(base + "/io", 'r') as f:
+                io = dict(line.split(': ', 1) for line in f.read().splitlines() if ': ' in line)
+            sample['read_bytes'] = int(io.get('read_bytes', 0))
+            sample['write_bytes'] = int(io.get('write_bytes', 0))
+        except PermissionError:
+            pass
+        sample['fds'] = len(os.listdir(base + "/fd"))
+        return sample
+    except (FileNotFoundError, ProcessLookupError, ValueError, IndexError):
+        return None
+
+class ResourceSampler:
+    """定期采样每个受管隧道进程的资源占用，每个服务的历史保存在固定大小的环形缓冲区中"""
+    
+    def __init__(self, services=None, history=120):
+        self.services = services
+        self.history = history
+        self.buffers = {}
+        self.pids = {}
+        self.previous = {}
+    
+    def discover(self):
+        """一次systemctl调用获取所有服务当前的MainPID"""
+        names = self.services or sorted(list_managed_units(get_install_paths()[1]))
+        states = query_unit_states(names)
+        return {name: int(states.get(name, {}).get('MainPID', '0') or 0) for name in names}
+    
+    def sample_once(self):
+        """对所有服务采样一次"""
+        self.pids = self.discover()
+        for name, pid in self.pids.items():
+            buffer = self.buffers.setdefault(name, collections.deque(maxlen=self.history))
+            sample = read_proc_sample(pid) if pid > 0 else None
+            if sample is None:
+                self.previous.pop(name, None)
+                continue
+            previous = self.previous.get(name)
+            # 进程重启后（PID或启动时间变化）不能与旧样本计算速率
+            if previous and previous['pid'] == pid and previous['start_ticks'] == sample['start_ticks']:
+                elapsed = sample['time'] - previous['time']
+                sample['cpu_percent'] = round(
+                    (sample['cpu_ticks'] - previous['cpu_ticks']) / CLOCK_TICKS / elapsed * 100, 1) if elapsed > 0 else None
+                for key in ('read_bytes', 'write_bytes'):
+                    if sample[key] is not None and previous[key] is not None and elapsed > 0:
+                        sample[key + '_per_sec'] = round((sample[key] - previous[key]) / elapsed)
+            else:
+                buffer.clear()
+            sample['pid'] = pid
+            self.previous[name] = sample
+            buffer.append(sample)
+    
+    def snapshot(self):
+        """生成可序列化为JSON的快照，包含最新样本以及缓冲区窗口内RSS和FD的变化量"""
+        result = {}
+        for name, pid in self.pids.items():
+            buffer = self.buffers.get(name)
+            if pid <= 0 or not buffer:
+                result[name] = {'pid': pid or None, 'running': False}
+                continue
+            first, latest = buffer[0], buffer[-1]
+            result[name] = {
+                'pid': pid,
+                'running': True,
+                'cpu_percent': latest.get('cpu_percent'),
+                'rss': latest['rss'],
+                'threads': latest['threads'],
+                'fds': latest['fds'],
+                'read_bytes': latest['read_bytes'],
+                'write_bytes': latest['write_bytes'],
+                'read_bytes_per_sec': latest.get('read_bytes_per_sec'),
+                'write_bytes_per_sec': latest.get('write_bytes_per_sec'),
+                'samples': len(buffer),
+                'window_seconds': round(latest['time'] - first['time'], 1),
+                'rss_growth': (latest['rss'] - first['rss']) if latest['rss'] is not None and first['rss'] is not None else None,
+                'fd_growth': latest['fds'] - first['fds'],
+            }
+        return result
+    
+    def run(self, interval, callback):
+        """按间隔持续采样，每次采样后调用callback(sampler)"""
+        while True:
+            started = time.time()
+            self.sample_once()
+            callback(self)
+            time.sleep(max(0.0, interval - (time.time() - started)))
+
+def print_resource_table(snapshot):
+    """以表格形式显示资源快照"""
+    def mb(value):
+        return "-" if value is None else f"{value / (1024 * 1024):.1f}"
+    def signed_mb(value):
+        return "-" if value is None else f"{value / (1024 * 1024):+.1f}"
+    def rate(value):
+        return "-" if value is None else f"{value / 1024:.1f}"
+    
+    # 表头使用ASCII，中文字符宽度不一致会导致列无法对齐
+    print(f"{'SERVICE':<24}{'PID':>8}{'CPU%':>7}{'RSS(MB)':>9}{'THR':>6}{'FD':>6}"
+          f"{'RD KB/s':>9}{'WR KB/s':>9}{'dRSS':>9}{'dFD':>7}")
+    for name, item in sorted(snapshot.items()):
+        if not item['running']:
+            print_color(f"{name:<24}{'-':>8}  未运行", Colors.YELLOW)
+            continue
+        cpu = "-" if item['cpu_percent'] is None else f"{item['cpu_percent']:.1f}"
+        line = (f"{name:<24}{item['pid']:>8}{cpu:>7}{mb(item['rss']):>9}{item['threads']:>6}{item['fds']:>6}"
+                f"{rate(item['read_bytes_per_sec']):>9}{rate(item['write_bytes_per_sec']):>9}"
+                f"{signed_mb(item['rss_growth']):>9}{item['fd_growth']:>+7}")
+        # RSS或FD在窗口内持续增长时高亮，便于发现内存和FD泄漏
+        growing = (item['rss_growth'] or 0) > 0 or item['fd_growth'] > 0
+        print_color(line, Colors.YELLOW if growing and item['samples'] > 1 else Colors.WHITE)
+
+def top_command(args):
+    """top命令: 实时显示每个隧道进程的资源占用"""
+    if platform.system() == 'Windows':
+        print_color("top仅支持Linux", Colors.RED)
+        return 1
+    sampler = ResourceSampler(args.service, args.history)
+    if args.json or args.once:
+        # 两次采样才能计算CPU和I/O速率
+        sampler.sample_once()
+        time.sleep(args.interval)
+        sampler.sample_once()
+        if args.json:
+            print(json.dumps(sampler.snapshot(), ensure_ascii=False, indent=2))
+        else:
+            print_resource_table(sampler.snapshot())
+        return 0
+    
+    def refresh(sampler):
+        print("\033[H\033[2J", end="")
+        print_color(f"cloudflared 资源占用  {time.strftime('%H:%M:%S')}  "
+                    f"(每 {args.interval} 秒刷新，Ctrl+C退出)", Colors.CYAN)
+        print_resource_table(sampler.snapshot())
+    
+    try:
+        sampler.run(args.interval, refresh)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+class LocalTransport:
+    """在本机子进程中执行，用于测试以及对本机执行fleet操作"""
+    
+    def __init__(self, python=None):
+        self.python = python or sys.executable
+    
+    def upload(self, host, data):
+        """把数据写入新建的临时文件并返回路径，每台主机使用独立的文件，并发执行时互不干扰"""
+        fd, path = tempfile.mkstemp(prefix='cloudflared-tool-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+    
+    def remove(self, host, path):
+        """删除upload创建的文件"""
+        os.remove(path)
+    
+    def run(self, host, argv, script, timeout=None):
+        """把脚本通过标准输入交给python执行，返回 (返回码, 输出)"""
+        result = subprocess.run([self.python, '-'] + argv,
+                                input=script,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                timeout=timeout)
+        return result.returncode, result.stdout.decode('utf-8', 'replace')
+
+class SSHTransport:
+    """通过ssh在远程主机上执行，脚本经标准输入传输，无需预先复制到目标主机"""
+    
+    def __init__(self, python="python3", sudo=True, ssh_options=None, connect_timeout=10):
+        self.python = python
+        self.sudo = sudo
+        self.ssh_options = ['-o', 'BatchMode=yes', '-o', f"ConnectTimeout={connect_timeout}"] + (ssh_options or [])
+    
+    def _ssh(self, host):
+        """解析 [user@]host[:port] 并生成ssh命令前缀"""
+        target, port = host, None
+        if ':' in host and not host.endswith(']'):
+            target, port = host.rsplit(':', 1)
+        return ['ssh'] + self.ssh_options + (['-p', port] if port else []) + [target]
+    
+    def upload(self, host, data):
+        """在远程主机上用mktemp创建仅当前用户可读写的临时文件并写入数据，返回远程路径
+        
+        不使用可预测的文件名，避免其他本地用户在/tmp中抢先创建同名文件或符号链接。
+        """
+        command = 'umask 077 && f=$(mktemp /tmp/cloudflared-tool.XXXXXXXXXX) && cat > "$f" && echo "$f"'
+        result = subprocess.run(self._ssh(host) + [command], input=data, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, check=True, timeout=60)
+        path = result.stdout.decode('utf-8', 'replace').strip()
+        if not path.startswith('/tmp/cloudflared-tool.'):
+            raise Exception(f"远程mktemp返回了意外的路径: {path!r}")
+        return path
+    
+    def remove(self, host, path):
+        """删除upload创建的远程文件"""
+        subprocess.run(self._ssh(host) + [f"rm -f -- {shlex.quote(path)}"], stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, check=True, timeout=60)
+    
+    def run(self, host, argv, script, timeout=None):
+        """在远程主机上执行，返回 (返回码, 输出)"""
+        command = ([] if not self.sudo else ['sudo', '-n']) + [self.python, '-'] + argv
+        result = subprocess.run(self._ssh(host) + [' '.join(shlex.quote(arg) for arg in command)],
+                                input=script,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                timeout=timeout)
+        return result.returncode, result.stdout.decode('utf-8', 'replace')
+
+FLEET_TRANSPORTS = {'ssh': SSHTransport, 'local': LocalTransport}
+
+# 参数列表中代表上传文件的占位符，执行时替换为每台主机上传后得到的路径
+FLEET_UPLOAD_ARG = '<desired-state.json>'
+
+def load_inventory(path):
+    """读取主机清单，每行一个 [user@]host[:port]，忽略空行和#注释"""
+    hosts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            host = line.split('#', 1)[0].strip()
+            if host and host not in hosts:
+                hosts.append(host)
+    return hosts
+
+def resolve_fleet_release(version=None):
+    """在控制端一次性确定目标版本和各Linux架构文件的SHA256，返回 (版本号, --sha256参数值或None)
+    
+    目标主机拿到版本号和SHA256后不再各自访问GitHub API，避免数百台主机共用出口IP时触发
+    未认证API每小时60次的限制；指定版本但控制端也取不到清单时，由目标主机自行获取。
+    """
+    configured = os.environ.get('CLOUDFLARED_SHA256', '').strip()
+    if version and configured:
+        return version, configured
+    try:
+        release, _ = fetch_release_manifest(version, quiet=True)
+    except Exception as e:
+        if not version:
+            raise Exception(f"无法获取最新版本: {str(e)}")
+        print_color(f"控制端获取发布清单失败，由目标主机自行获取: {str(e)}", Colors.YELLOW)
+        return version, configured or None
+    if configured:
+        return release['tag_name'], configured
+    linux_assets = {get_asset_name('Linux', 'x86_64'), get_asset_name('Linux', 'aarch64')}
+    digests = []
+    for asset in release['assets']:
+        digest = asset.get('digest') or ''
+        if asset['name'] in linux_assets and digest.startswith('sha256:'):
+            digests.append(f"{asset['name']}={digest.split(':', 1)[1].lower()}")
+    return release['tag_name'], ",".join(sorted(digests)) or None
+
+def build_fleet_action(args):
+    """把fleet动作转换为在每台主机上执行的子命令，返回 (参数列表, 需要上传的数据或None)"""
+    argv = []
+    # 本机的下载源同样用于目标主机；控制端的代理通常对目标主机无效，只转发 --remote-proxy 指定的代理
+    for mirror in os.environ.get('CLOUDFLARED_MIRRORS', '').split(','):
+        if mirror:
+            argv += ['--mirror', mirror]
+    if args.remote_proxy:
+        argv += ['--proxy', args.remote_proxy]
+    upload = None
+    
+    if args.action == 'install':
+        version, sha256 = resolve_fleet_release(args.version)
+        argv += (['--sha256', sha256] if sha256 else []) + ['upgrade', '--version', version]
+    elif args.action == 'service':
+        version, sha256 = resolve_fleet_release(args.version) if args.version else (None, None)
+        # 单个服务也通过reconcile创建，保证重复执行时是幂等的
+        desired = {'version': version, 'instances': [
+            {'name': args.service, 'origin': args.url, 'log': args.log}]}
+        upload = json.dumps(desired, ensure_ascii=False).encode('utf-8')
+        argv += (['--sha256', sha256] if sha256 else []) + ['reconcile', FLEET_UPLOAD_ARG]
+    elif args.action == 'reconcile':
+        with open(args.file, 'rb') as f:
+            upload = f.read()
+        version = json.loads(upload.decode('utf-8')).get('version')
+        sha256 = resolve_fleet_release(version)[1] if version else None
+        argv += (['--sha256', sha256] if sha256 else []) + ['reconcile', FLEET_UPLOAD_ARG]
+        argv += (['--prune'] if args.prune else []) + (['--dry-run'] if args.dry_run else [])
+    return argv, upload
+
+def run_fleet_host(transport, host, script, argv, upload, timeout):
+    """在单台主机上执行fleet动作，返回结果字典"""
+    start_time = time.time()
+    result = {'host': host, 'ok': False, 'returncode': None, 'elapsed': 0.0, 'output': ''}
+    remote_path = None
+    try:
+        if upload is not None:
+            remote_path = transport.upload(host, upload)
+            argv = [remote_path if arg == FLEET_UPLOAD_ARG else arg for arg in argv]
+        result['returncode'], output = transport.run(host, argv, script, timeout)
+        result['ok'] = result['returncode'] == 0
+        # 只保留输出末尾，避免数百台主机的输出占用大量内存
+        result['output'] = output[-2000:]
+    except subprocess.TimeoutExpired:
+        result['output'] = f"执行超时 ({timeout} 秒)"
+    except Exception as e:
+        result['output'] = str(e)
+    finally:
+        if remote_path:
+            try:
+                transport.remove(host, remote_path)
+            except Exception:
+                pass
+    result['elapsed'] = time.time() - start_time
+    return result
+
+def fleet_command(args):
+    """fleet命令: 按主机清单并发执行安装、服务或reconcile操作"""
+    # add_subparsers的required参数需要Python 3.7+，这里手动检查
+    if not args.action:
+        print_color("请指定fleet操作: install、service 或 reconcile", Colors.RED)
+        return 1
+    try:
+        hosts = load_inventory(args.inventory)
+        argv, upload = build_fleet_action(args)
+    except Exception as e:
+        print_color(f"准备fleet操作失败: {str(e)}", Colors.RED)
+        return 1
+    if not hosts:
+        print_color("主机清单为空", Colors.RED)
+        return 1
+    with open(os.path.abspath(__file__), 'rb') as f:
+        script = f.read()
+    if args.transport == 'ssh':
+        transport = SSHTransport(python=args.python, sudo=not args.no_sudo)
+    else:
+        transport = LocalTransport()
+    
+    print_color(f"在 {len(hosts)} 台主机上执行: {' '.join(argv)} (并发 {args.parallel})", Colors.CYAN)
+    start_time = time.time()
+    results = []
+    failures = 0
+    aborted = False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+        futures = [executor.submit(run_fleet_host, transport, host, script, argv, upload, args.timeout)
+                   for host in hosts]
+        # 每台主机完成时立即输出结果
+        for future in concurrent.futures.as_completed(futures):
+            if future.cancelled():
+                continue
+            result = future.result()
+            results.append(result)
+            if result['ok']:
+                print_color(f"[{len(results)}/{len(hosts)}] 成功 {result['host']} ({result['elapsed']:.1f} 秒)",
+                            Colors.GREEN)
+            else:
+                failures += 1
+                last_line = (result['output'].strip().splitlines() or [''])[-1]
+                print_color(f"[{len(results)}/{len(hosts)}] 失败 {result['host']} "
+                            f"({result['elapsed']:.1f} 秒): {last_line}", Colors.RED)
+                if args.max_failures is not None and failures > args.max_failures and not aborted:
+                    aborted = True
+                    cancelled = sum(1 for f in futures if f.cancel())
+                    print_color(f"失败数超过 {args.max_failures}，取消剩余的 {cancelled} 台主机", Colors.RED)
+    
+    elapsed = time.time() - start_time
+    durations = sorted(r['elapsed'] for r in results)
+    succeeded = len(results) - failures
+    print_color(f"\n完成: 成功 {succeeded}，失败 {failures}，未执行 {len(hosts) - len(results)}，"
+                f"总耗时 {elapsed:.1f} 秒", Colors.GREEN if not failures else Colors.YELLOW)
+    if durations:
+        p50 = durations[len(durations) // 2]
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        print_color(f"单台耗时: 中位数 {p50:.1f} 秒，P95 {p95:.1f} 秒，最长 {durations[-1]:.1f} 秒", Colors.CYAN)
+    if args.report:
+        report = {
+            'action': argv,
+            'started_at': start_time,
+            'elapsed': elapsed,
+            'hosts': len(hosts),
+            'succeeded': succeeded,
+            'failed': failures,
+            'results': sorted(results, key=lambda r: r['host']),
+        }
+        save_json_file(os.path.abspath(args.report), report)
+        print_color(f"报告已保存: {args.report}", Colors.CYAN)
+    return 0 if not failures and len(results) == len(hosts) else 1
+
+def build_arg_parser():
+    """构建命令行参数解析器，不带参数运行时进入交互式设置"""
+    parser = argparse.ArgumentParser(description="CloudFlared Tunnel 设置工具")
+    parser.add_argument('--mirror', action='append',
+                        help="额外的下载源地址模板，可使用{version}和{asset}，可重复指定")
+    parser.add_argument('--proxy', help="下载使用的HTTP代理")
+    parser.add_argument('--sha256',
+                        help="目标版本的SHA256，格式为 <SHA256> 或逗号分隔的 <文件名>=<SHA256>，"
+                             "给定后无需访问GitHub即可校验镜像下载")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    upgrade_parser = subparsers.add_parser('upgrade', help="无中断升级cloudflared")
+    upgrade_parser.add_argument('--version', help="目标版本，默认使用最新发布版本")
+    upgrade_parser.add_argument('--service', action='append',
+                                help="升级后需要重启的服务，可重复指定，默认cloudflared")
+    upgrade_parser.add_argument('--force', action='store_true', help="即使版本相同也重新安装")
+    upgrade_parser.add_argument('--timeout', type=int, default=60, help="等待服务就绪的秒数")
+    upgrade_parser.add_argument('--grace-period', default='30s', help="停止临时实例时的连接排空时间")
+    upgrade_parser.add_argument('--cache-dir', help="发布清单缓存目录")
+    upgrade_parser.set_defaults(func=upgrade_command)
+    
+    reconfigure_parser = subparsers.add_parser('reconfigure', help="就地修改现有服务的源站地址、日志或ingress配置")
+    reconfigure_parser.add_argument('--service', default='cloudflared', help="服务名称，默认cloudflared")
+    reconfigure_parser.add_argument('--url', help="新的本地服务地址")
+    reconfigure_parser.add_argument('--log', help="新的日志文件路径")
+    reconfigure_parser.add_argument('--config', help="新的ingress配置文件（命名隧道）")
+    reconfigure_parser.add_argument('--timeout', type=int, default=60, help="等待服务就绪的秒数")
+    reconfigure_parser.add_argument('--grace-period', default='30s', help="重叠重启时临时实例的连接排空时间")
+    reconfigure_parser.set_defaults(func=reconfigure_command)
+    
+    reconcile_parser = subparsers.add_parser('reconcile', help="按期望状态文件收敛本机的隧道服务")
+    reconcile_parser.add_argument('file', help="期望状态文件(JSON)")
+    reconcile_parser.add_argument('--dry-run', action='store_true', help="只显示操作计划，不执行")
+    reconcile_parser.add_argument('--prune', action='store_true', help="删除期望状态中不存在的受管服务")
+    reconcile_parser.add_argument('--parallel', type=int, default=4, help="并发启动/重启服务的数量")
+    reconcile_parser.add_argument('--cache-dir', help="缓存目录")
+    reconcile_parser.set_defaults(func=reconcile_command)
+    
+    teardown_parser = subparsers.add_parser('teardown', help="并行卸载一个或多个服务并归档日志")
+    teardown_parser.add_argument('names', nargs='*', help="服务名称")
+    teardown_parser.add_argument('--all', action='store_true', help="卸载所有受管服务")
+    teardown_parser.add_argument('--no-archive', action='store_true', help="不归档日志")
+    teardown_parser.add_argument('--compress', action='store_true', help="归档日志时使用gzip压缩")
+    teardown_parser.add_argument('--timeout', type=int, default=90, help="等待进程退出的秒数")
+    teardown_parser.add_argument('--parallel', type=int, default=16, help="并发等待的服务数量")
+    teardown_parser.set_defaults(func=teardown_command)
+    
+    logs_parser = subparsers.add_parser('logs', help="统计cloudflared日志（连接、重连、边缘节点、源站错误）")
+    logs_parser.add_argument('paths', nargs='*', help="日志文件，- 表示标准输入；默认分析所有受管服务的日志")
+    logs_parser.add_argument('--service', help="分析指定服务的日志")
+    logs_parser.add_argument('--no-rotated', dest='rotated', action='store_false',
+                             help="不包含轮转和归档的日志分段")
+    logs_parser.add_argument('--follow', action='store_true', help="持续跟踪日志并定期输出统计")
+    logs_parser.add_argument('--interval', type=float, default=10, help="跟踪模式下输出统计的间隔秒数")
+    logs_parser.add_argument('--json', action='store_true', help="以JSON格式输出")
+    logs_parser.set_defaults(func=logs_command)
+    
+    top_parser = subparsers.add_parser('top', help="实时显示每个隧道进程的CPU、内存、线程、FD和I/O")
+    top_parser.add_argument('--service', action='append', help="只显示指定服务，可重复指定，默认所有受管服务")
+    top_parser.add_argument('--interval', type=float, default=2, help="采样间隔秒数")
+    top_parser.add_argument('--history', type=int, default=120, help="每个服务保留的样本数")
+    top_parser.add_argument('--once', action='store_true', help="采样一次后输出表格并退出")
+    top_parser.add_argument('--json', action='store_true', help="输出JSON快照并退出")
+    top_parser.set_defaults(func=top_command)
+    
+    fleet_parser = subparsers.add_parser('fleet', help="按主机清单并发部署到多台主机")
+    fleet_parser.add_argument('inventory', help="主机清单文件，每行一个 [user@]host[:port]")
+    fleet_parser.add_argument('--parallel', type=int, default=20, help="同时操作的主机数量")
+    fleet_parser.add_argument('--transport', choices=sorted(FLEET_TRANSPORTS), default='ssh',
+                              help="执行方式，local在本机子进程中执行（用于测试）")
+    fleet_parser.add_argument('--python', default='python3', help="目标主机上的Python解释器")
+    fleet_parser.add_argument('--no-sudo', action='store_true', help="目标主机上不使用sudo")
+    fleet_parser.add_argument('--timeout', type=int, default=600, help="单台主机的超时秒数")
+    fleet_parser.add_argument('--max-failures', type=int, help="失败主机数超过此值时取消剩余主机")
+    fleet_parser.add_argument('--report', help="保存每台主机耗时和结果的JSON报告")
+    fleet_parser.add_argument('--remote-proxy', help="目标主机下载时使用的代理，默认不传递控制端的代理")
+    fleet_actions = fleet_parser.add_subparsers(dest='action')
+    install_action = fleet_actions.add_parser('install', help="安装或升级cloudflared")
+    install_action.add_argument('--version', help="目标版本，默认最新版本")
+    service_action = fleet_actions.add_parser('service', help="创建或更新一个隧道服务")
+    service_action.add_argument('--url', required=True, help="本地服务地址")
+    service_action.add_argument('--service', default='cloudflared', help="服务名称")
+    service_action.add_argument('--log', help="日志文件路径，默认 /var/log/<服务名>.log")
+    service_action.add_argument('--version', help="同时确保cloudflared为此版本")
+    reconcile_action = fleet_actions.add_parser('reconcile', help="按期望状态文件收敛每台主机")
+    reconcile_action.add_argument('file', help="期望状态文件(JSON)")
+    reconcile_action.add_argument('--prune', action='store_true', help="删除期望状态中不存在的受管服务")
+    reconcile_action.add_argument('--dry-run', action='store_true', help="只显示每台主机的操作计划")
+    fleet_parser.set_defaults(func=fleet_command)
+    
+    return parser
+
+def cli(argv=None):
+    """命令行入口"""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        require_root()
+        main()
+        return 0
+    args = build_arg_parser().parse_args(argv)
+    # 只按解析出的子命令判断，选项的值（如 --mirror logs）不会被误认为子命令
+    if args.command not in NO_ROOT_COMMANDS:
+        require_root()
+    # 下载源和代理通过环境变量传递给所有下载路径
+    if args.mirror:
+        mirrors = [m for m in os.environ.get('CLOUDFLARED_MIRRORS', '').split(',') if m]
+        os.environ['CLOUDFLARED_MIRRORS'] = ','.join(mirrors + args.mirror)
+    if args.proxy:
+        os.environ['CLOUDFLARED_PROXY'] = args.proxy
+    if args.sha256:
+        os.environ['CLOUDFLARED_SHA256'] = args.sha256
+    if not getattr(args, 'func', None):
+        main()
+        return 0
+    return args.func(args)
+
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())
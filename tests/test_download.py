@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# 下载逻辑的本地测试: 用注入了延迟、停顿和限速的本地HTTP服务器模拟镜像源
+# 运行: python -m pytest tests 或 python -m unittest discover tests
+
+import hashlib
+import http.server
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cloudflared
+
+PAYLOAD = os.urandom(512 * 1024)
+CHUNK = 16 * 1024
+
+def start_server(delay=0.0, stall_after=None, rate=None, throttle_after=0, ranges=True, status=None):
+    """启动一个本地下载源，返回 (地址, 收到的Range请求头列表)
+
+    delay: 发送响应头前等待的秒数
+    stall_after: 发送到该字节偏移后停止发送（连接保持打开）
+    rate: 限速，字节/秒，从throttle_after字节偏移开始生效
+    ranges: 是否支持范围请求
+    status: 固定返回的错误状态码
+    """
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            requests.append(self.headers.get('Range'))
+            time.sleep(delay)
+            if status:
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = 0, len(PAYLOAD) - 1
+            range_header = self.headers.get('Range')
+            if range_header and ranges:
+                first, last = range_header.split('=', 1)[1].split('-')
+                start, end = int(first), int(last) if last else end
+                self.send_response(206)
+                self.send_header('Content-Range', f"bytes {start}-{end}/{len(PAYLOAD)}")
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            try:
+                for pos in range(start, end + 1, CHUNK):
+                    if stall_after is not None and pos >= stall_after:
+                        time.sleep(30)
+                        return
+                    self.wfile.write(PAYLOAD[pos:min(pos + CHUNK, end + 1)])
+                    if rate and pos >= throttle_after:
+                        time.sleep(CHUNK / rate)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/cloudflared", requests
+
+class DownloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.servers = []
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.tmp_dir, 'cloudflared')
+        self.addCleanup(self._cleanup)
+        # 测试环境中不使用代理
+        patcher = mock.patch.dict(os.environ, {'CLOUDFLARED_PROXY': '', 'no_proxy': '127.0.0.1'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _cleanup(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        for name in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, name))
+        os.rmdir(self.tmp_dir)
+
+    def serve(self, **kwargs):
+        server, url, requests = start_server(**kwargs)
+        self.servers.append(server)
+        return url, requests
+
+    def read_output(self):
+        with open(self.output_path, 'rb') as f:
+            return f.read()
+
+class OpenUrlTest(DownloadTestCase):
+
+    def test_read_timeout_uses_module_constant_at_call_time(self):
+        url, _ = self.serve(stall_after=CHUNK)
+        with mock.patch.object(cloudflared, 'READ_TIMEOUT', 0.3):
+            with cloudflared.open_url(url) as response:
+                self.assertEqual(len(response.read(CHUNK)), CHUNK)
+                start_time = time.time()
+                with self.assertRaises(socket.timeout):
+                    response.read(CHUNK)
+        self.assertLess(time.time() - start_time, 2)
+
+    def test_connect_timeout_does_not_limit_reads(self):
+        # 响应头延迟0.5秒发送，连接超时很短也不影响，只受读取超时限制
+        url, _ = self.serve(delay=0.5)
+        with cloudflared.open_url(url, connect_timeout=0.1, read_timeout=5) as response:
+            self.assertEqual(response.read(), PAYLOAD)
+
+    def test_range_request(self):
+        url, requests = self.serve()
+        with cloudflared.open_url(url, 100, 199) as response:
+            self.assertEqual(response.status, 206)
+            self.assertEqual(response.read(), PAYLOAD[100:200])
+            self.assertEqual(cloudflared.get_total_size(response), len(PAYLOAD))
+        self.assertEqual(requests, ['bytes=100-199'])
+
+class RaceSourcesTest(DownloadTestCase):
+
+    def test_fastest_source_first_and_failed_sources_dropped(self):
+        slow, _ = self.serve(delay=0.3)
+        fast, _ = self.serve()
+        broken, _ = self.serve(status=500)
+        ranked = cloudflared.race_sources([slow, broken, fast])
+        self.assertEqual([source['url'] for source in ranked], [fast, slow])
+        self.assertTrue(all(source['ranges'] for source in ranked))
+
+    def test_unresponsive_source_kept_as_fallback(self):
+        slow, _ = self.serve(delay=1.5)
+        fast, _ = self.serve()
+        with mock.patch.object(cloudflared, 'PROBE_GRACE', 0.2):
+            ranked = cloudflared.race_sources([slow, fast])
+        self.assertEqual([source['url'] for source in ranked], [fast, slow])
+
+class FetchToFileTest(DownloadTestCase):
+
+    def test_single_source(self):
+        url, _ = self.serve()
+        cloudflared.fetch_to_file(url, self.output_path)
+        self.assertEqual(self.read_output(), PAYLOAD)
+        self.assertFalse(os.path.exists(self.output_path + ".part"))
+
+    def test_stalled_source_resumes_on_next_source(self):
+        stalling, _ = self.serve(stall_after=256 * 1024)
+        backup, requests = self.serve(delay=0.3)
+        with mock.patch.object(cloudflared, 'READ_TIMEOUT', 0.5):
+            cloudflared.fetch_to_file([stalling, backup], self.output_path)
+        self.assertEqual(self.read_output(), PAYLOAD)
+        # 第一个请求是探测，第二个请求从停顿的位置继续
+        self.assertEqual(requests[-1], f"bytes={256 * 1024}-")
+
+    def test_slow_source_switches_on_low_throughput(self):
+        # 探测阶段速度正常，传输开始后限速
+        throttled, _ = self.serve(rate=64 * 1024, throttle_after=cloudflared.PROBE_BYTES)
+        backup, requests = self.serve(delay=0.3)
+        with mock.patch.object(cloudflared, 'THROUGHPUT_WINDOW', 0.3), \
+                mock.patch.object(cloudflared, 'MIN_THROUGHPUT', 1024 * 1024):
+            start_time = time.time()
+            cloudflared.fetch_to_file([throttled, backup], self.output_path)
+        self.assertEqual(self.read_output(), PAYLOAD)
+        self.assertLess(time.time() - start_time, 5)
+        self.assertTrue(requests[-1].startswith('bytes=') and requests[-1] != 'bytes=0-')
+
+    def test_source_without_ranges_restarts_from_zero(self):
+        stalling, _ = self.serve(stall_after=256 * 1024)
+        no_ranges, _ = self.serve(delay=0.3, ranges=False)
+        with mock.patch.object(cloudflared, 'READ_TIMEOUT', 0.5):
+            cloudflared.fetch_to_file([stalling, no_ranges], self.output_path)
+        self.assertEqual(self.read_output(), PAYLOAD)
+
+    def test_all_sources_failing_leaves_no_files(self):
+        broken, _ = self.serve(status=500)
+        with self.assertRaises(Exception):
+            cloudflared.fetch_to_file(broken, self.output_path)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_abort_event_stops_download(self):
+        url, _ = self.serve(rate=64 * 1024)
+        abort_event = threading.Event()
+        threading.Timer(0.3, abort_event.set).start()
+        start_time = time.time()
+        with self.assertRaises(Exception):
+            cloudflared.fetch_to_file(url, self.output_path, abort_event)
+        self.assertLess(time.time() - start_time, 2)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+class TrustedDownloadUrlsTest(unittest.TestCase):
+
+    def test_mirrors_only_used_with_digest(self):
+        primary = cloudflared.get_download_url('2024.12.2')
+        with mock.patch.dict(os.environ, {'CLOUDFLARED_MIRRORS': 'http://mirror.local/cf'}):
+            self.assertEqual(cloudflared.get_trusted_download_urls('2024.12.2'), [primary])
+            urls = cloudflared.get_trusted_download_urls('2024.12.2', 'a' * 64)
+        self.assertEqual(len(urls), 2)
+        self.assertTrue(urls[0].startswith('http://mirror.local/cf/2024.12.2/'))
+        self.assertEqual(urls[-1], primary)
+
+class ConfiguredSha256Test(DownloadTestCase):
+
+    def test_parse_plain_and_per_asset_values(self):
+        digest = hashlib.sha256(PAYLOAD).hexdigest()
+        with mock.patch.dict(os.environ, {'CLOUDFLARED_SHA256': digest.upper()}):
+            self.assertEqual(cloudflared.get_configured_sha256('cloudflared-linux-amd64'), digest)
+        value = f"cloudflared-linux-arm64={'1' * 64},cloudflared-linux-amd64={digest}"
+        with mock.patch.dict(os.environ, {'CLOUDFLARED_SHA256': value}):
+            self.assertEqual(cloudflared.get_configured_sha256('cloudflared-linux-amd64'), digest)
+            self.assertIsNone(cloudflared.get_configured_sha256('cloudflared-windows-amd64.exe'))
+        with mock.patch.dict(os.environ, {'CLOUDFLARED_SHA256': 'not-a-digest'}):
+            with self.assertRaises(ValueError):
+                cloudflared.get_configured_sha256()
+
+    def test_mirror_used_when_github_unreachable(self):
+        # GitHub的API和下载地址都无响应时，凭预先给定的SHA256从镜像下载并校验
+        github, _ = self.serve(delay=5)
+        mirror, requests = self.serve()
+        env = {'CLOUDFLARED_SHA256': hashlib.sha256(PAYLOAD).hexdigest(),
+               'CLOUDFLARED_MIRRORS': mirror + '/{version}/{asset}'}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch.object(cloudflared, 'RELEASE_DOWNLOAD_URL', github + '/{version}/{asset}'), \
+                mock.patch.object(cloudflared, 'fetch_release_manifest',
+                                  side_effect=AssertionError("不应访问GitHub API")):
+            result = cloudflared.prepare_release_binary('2024.12.2', self.output_path, 'Linux')
+        self.assertTrue(result['ok'], result['error'])
+        self.assertTrue(result['verified'])
+        self.assertEqual(self.read_output(), PAYLOAD)
+        self.assertTrue(requests)
+
+    def test_invalid_configured_value_fails_download(self):
+        with mock.patch.dict(os.environ, {'CLOUDFLARED_SHA256': 'abc'}):
+            result = cloudflared.prepare_release_binary('2024.12.2', self.output_path, 'Linux')
+        self.assertFalse(result['ok'])
+        self.assertIn('CLOUDFLARED_SHA256', result['error'])
+
+class PrepareBinaryTest(DownloadTestCase):
+
+    def test_matching_digest_is_verified(self):
+        url, _ = self.serve()
+        result = cloudflared.prepare_binary(url, self.output_path, 'Linux',
+                                            expected_sha256=hashlib.sha256(PAYLOAD).hexdigest())
+        self.assertTrue(result['ok'])
+        self.assertTrue(result['verified'])
+        self.assertTrue(os.access(self.output_path, os.X_OK))
+
+    def test_mismatching_digest_removes_file(self):
+        url, _ = self.serve()
+        result = cloudflared.prepare_binary(url, self.output_path, 'Linux', expected_sha256='0' * 64)
+        self.assertFalse(result['ok'])
+        self.assertIn('SHA256', result['error'])
+        self.assertFalse(os.path.exists(self.output_path))
+
+if __name__ == '__main__':
+    unittest.main()
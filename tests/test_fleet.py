@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# fleet的测试: 检查控制端生成的目标主机参数，版本和SHA256只在控制端获取一次
+# 运行: python -m pytest tests 或 python -m unittest discover tests
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cloudflared
+
+AMD64_SHA256 = 'a' * 64
+ARM64_SHA256 = 'b' * 64
+RELEASE = {
+    'tag_name': '2025.1.0',
+    'assets': [
+        {'name': 'cloudflared-linux-amd64', 'url': 'https://example.invalid/amd64',
+         'digest': 'sha256:' + AMD64_SHA256},
+        {'name': 'cloudflared-linux-arm64', 'url': 'https://example.invalid/arm64',
+         'digest': 'sha256:' + ARM64_SHA256},
+        {'name': 'cloudflared-windows-amd64.exe', 'url': 'https://example.invalid/win',
+         'digest': 'sha256:' + 'c' * 64},
+    ],
+}
+
+class FleetActionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        patcher = mock.patch.dict(os.environ, {'CLOUDFLARED_MIRRORS': '', 'CLOUDFLARED_PROXY': '',
+                                               'CLOUDFLARED_SHA256': ''})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manifest = mock.patch.object(cloudflared, 'fetch_release_manifest',
+                                          return_value=(RELEASE, 'network'))
+        self.fetch = self.manifest.start()
+        self.addCleanup(self.manifest.stop)
+
+    def build(self, *argv):
+        args = cloudflared.build_arg_parser().parse_args(['fleet', 'hosts.txt'] + list(argv))
+        return cloudflared.build_fleet_action(args)
+
+    def test_install_resolves_latest_release_once_on_controller(self):
+        argv, upload = self.build('install')
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertIsNone(upload)
+        expected_sha256 = f"cloudflared-linux-amd64={AMD64_SHA256},cloudflared-linux-arm64={ARM64_SHA256}"
+        self.assertEqual(argv, ['--sha256', expected_sha256, 'upgrade', '--version', '2025.1.0'])
+
+    def test_host_does_not_query_api_with_forwarded_digest(self):
+        argv, _ = self.build('install')
+        with mock.patch.dict(os.environ, {'CLOUDFLARED_SHA256': argv[1]}):
+            version, _, sha256, source = cloudflared.resolve_release_asset('2025.1.0')
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertEqual((version, source), ('2025.1.0', 'configured'))
+        self.assertIn(sha256, (AMD64_SHA256, ARM64_SHA256))
+
+    def test_reconcile_uses_version_from_desired_state(self):
+        path = os.path.join(self.tmp_dir, 'desired.json')
+        with open(path, 'w') as f:
+            json.dump({'version': '2025.1.0', 'instances': []}, f)
+        argv, upload = self.build('reconcile', path, '--prune')
+        self.fetch.assert_called_once_with('2025.1.0', quiet=True)
+        self.assertEqual(argv[0], '--sha256')
+        self.assertEqual(argv[2:], ['reconcile', cloudflared.FLEET_UPLOAD_ARG, '--prune'])
+        self.assertEqual(json.loads(upload.decode('utf-8'))['version'], '2025.1.0')
+
+    def test_service_without_version_does_not_query_api(self):
+        argv, upload = self.build('service', '--url', '127.0.0.1:8080')
+        self.fetch.assert_not_called()
+        self.assertEqual(argv, ['reconcile', cloudflared.FLEET_UPLOAD_ARG])
+        self.assertIsNone(json.loads(upload.decode('utf-8'))['version'])
+
+    def test_install_without_manifest_fails_on_controller(self):
+        self.fetch.side_effect = OSError("unreachable")
+        with self.assertRaises(Exception):
+            self.build('install')
+
+    def test_pinned_version_without_manifest_uses_configured_digest(self):
+        self.fetch.side_effect = OSError("unreachable")
+        with mock.patch.dict(os.environ, {'CLOUDFLARED_SHA256': AMD64_SHA256}):
+            argv, _ = self.build('install', '--version', '2024.12.2')
+        self.assertEqual(argv, ['--sha256', AMD64_SHA256, 'upgrade', '--version', '2024.12.2'])
+
+    def test_controller_proxy_is_not_forwarded(self):
+        with mock.patch.dict(os.environ, {'CLOUDFLARED_PROXY': 'http://controller-proxy:3128',
+                                          'CLOUDFLARED_MIRRORS': 'http://mirror.local/cf'}):
+            argv, _ = self.build('install')
+            self.assertNotIn('--proxy', argv)
+            self.assertEqual(argv[:2], ['--mirror', 'http://mirror.local/cf'])
+            args = cloudflared.build_arg_parser().parse_args(
+                ['fleet', 'hosts.txt', '--remote-proxy', 'http://site-proxy:3128', 'install'])
+            argv, _ = cloudflared.build_fleet_action(args)
+        self.assertEqual(argv[argv.index('--proxy') + 1], 'http://site-proxy:3128')
+
+    def test_missing_action_is_an_error(self):
+        args = cloudflared.build_arg_parser().parse_args(['fleet', 'hosts.txt'])
+        self.assertIsNone(args.action)
+        with mock.patch.object(cloudflared, 'print_color'):
+            self.assertEqual(cloudflared.fleet_command(args), 1)
+        self.fetch.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# 日志统计的测试: 使用cloudflared实际输出的控制台格式和 --logfile JSON格式日志行
+# 运行: python -m pytest tests 或 python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cloudflared
+
+ORIGIN_ERROR = ("Unable to reach the origin service. The service may be down or it may not be responding "
+                "to traffic from cloudflared: dial tcp 127.0.0.1:8080: connect: connection refused")
+
+# 同一组事件的两种格式，按cloudflared同时写标准输出和 --logfile 时的顺序排列
+CONSOLE_LINES = [
+    '2024-12-10T08:00:00Z INF Starting tunnel tunnelID=6ff42ae2-765d-4adf-8112-31c55c1551ef',
+    '2024-12-10T08:00:01Z INF Registered tunnel connection connIndex=0 '
+    'connection=5b1e7f0c-2d4e-4c9a-9f0e-6c1b3e2a7d11 event=0 ip=198.41.200.13 location=lax01 protocol=quic',
+    '2024-12-10T08:00:01Z INF Registered tunnel connection connIndex=1 '
+    'connection=0f7d6c2a-8f3b-4b1e-a0d2-1c9e4b7a5e22 event=0 ip=198.41.192.7 location=sjc05 protocol=quic',
+    f'2024-12-10T08:10:05Z ERR  error="{ORIGIN_ERROR}" cfRay=8f0a1b2c3d4e5f60-LAX event=1 '
+    'ingressRule=0 originService=http://127.0.0.1:8080',
+    f'2024-12-10T08:10:05Z ERR Request failed error="{ORIGIN_ERROR}" connIndex=0 '
+    'dest=https://app.example.com/ event=0 ip=198.41.200.13 type=http',
+    '2024-12-10T09:00:00Z ERR Serve tunnel error error="timeout: no recent network activity" '
+    'connIndex=0 event=0 ip=198.41.200.13',
+    '2024-12-10T09:00:00Z INF Retrying connection in up to 1s connIndex=0 event=0 ip=198.41.200.13',
+    '2024-12-10T09:00:02Z INF Registered tunnel connection connIndex=0 '
+    'connection=9a3c1e5b-7d2f-4e8a-b6c4-2f1d3e5a7b33 event=0 ip=198.41.200.13 location=lax01 protocol=quic',
+    '2024-12-10T10:00:00Z INF Initiating graceful shutdown due to signal terminated ...',
+]
+
+JSON_LINES = [
+    '{"level":"info","tunnelID":"6ff42ae2-765d-4adf-8112-31c55c1551ef",'
+    '"time":"2024-12-10T08:00:00Z","message":"Starting tunnel"}',
+    '{"level":"info","connIndex":0,"connection":"5b1e7f0c-2d4e-4c9a-9f0e-6c1b3e2a7d11","event":0,'
+    '"ip":"198.41.200.13","location":"lax01","protocol":"quic","time":"2024-12-10T08:00:01Z",'
+    '"message":"Registered tunnel connection"}',
+    '{"level":"info","connIndex":1,"connection":"0f7d6c2a-8f3b-4b1e-a0d2-1c9e4b7a5e22","event":0,'
+    '"ip":"198.41.192.7","location":"sjc05","protocol":"quic","time":"2024-12-10T08:00:01Z",'
+    '"message":"Registered tunnel connection"}',
+    f'{{"level":"error","error":"{ORIGIN_ERROR}","cfRay":"8f0a1b2c3d4e5f60-LAX","event":1,'
+    '"ingressRule":0,"originService":"http://127.0.0.1:8080","time":"2024-12-10T08:10:05Z"}',
+    f'{{"level":"error","error":"{ORIGIN_ERROR}","connIndex":0,"dest":"https://app.example.com/",'
+    '"event":0,"ip":"198.41.200.13","type":"http","time":"2024-12-10T08:10:05Z","message":"Request failed"}',
+    '{"level":"error","connIndex":0,"error":"timeout: no recent network activity","event":0,'
+    '"ip":"198.41.200.13","time":"2024-12-10T09:00:00Z","message":"Serve tunnel error"}',
+    '{"level":"info","connIndex":0,"event":0,"ip":"198.41.200.13","time":"2024-12-10T09:00:00Z",'
+    '"message":"Retrying connection in up to 1s"}',
+    '{"level":"info","connIndex":0,"connection":"9a3c1e5b-7d2f-4e8a-b6c4-2f1d3e5a7b33","event":0,'
+    '"ip":"198.41.200.13","location":"lax01","protocol":"quic","time":"2024-12-10T09:00:02Z",'
+    '"message":"Registered tunnel connection"}',
+    '{"level":"info","time":"2024-12-10T10:00:00Z","message":"Initiating graceful shutdown due to signal terminated"}',
+]
+
+EXPECTED = {
+    'starts': 1,
+    'registrations': 3,
+    'reconnects': 1,
+    'retries': 1,
+    'connection_errors': 1,
+    'origin_errors': 1,
+    'uptime_seconds': 7200.0,
+    'colos': {'LAX': 2, 'SJC': 1},
+    'protocols': {'quic': 3},
+}
+
+class LogAnalyticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def analyze(self, lines):
+        path = os.path.join(self.tmp_dir, 'cloudflared.log')
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        return cloudflared.analyze_log('test', [path])
+
+    def assertSummary(self, summary):
+        for key, value in EXPECTED.items():
+            self.assertEqual(summary[key], value, key)
+
+    def test_console_format(self):
+        self.assertSummary(self.analyze(CONSOLE_LINES))
+
+    def test_json_format(self):
+        self.assertSummary(self.analyze(JSON_LINES))
+
+    def test_mixed_formats_in_one_file(self):
+        # 默认单元中标准输出和 --logfile 写入同一个文件，每个事件出现两次
+        lines = []
+        for console_line, json_line in zip(CONSOLE_LINES, JSON_LINES):
+            lines.extend([console_line, json_line])
+        self.assertSummary(self.analyze(lines))
+
+    def test_mixed_formats_out_of_order(self):
+        # 两个写入者的输出在同一秒内可能交错，JSON行先出现也应配对
+        lines = []
+        for console_line, json_line in zip(CONSOLE_LINES, JSON_LINES):
+            lines.extend([json_line, console_line])
+        self.assertSummary(self.analyze(lines))
+
+    def test_repeated_events_in_same_second_are_not_merged(self):
+        # 同一秒内两个不同请求的源站错误应各计一次
+        error_lines = [line for line in CONSOLE_LINES if 'cfRay=' in line]
+        summary = self.analyze(CONSOLE_LINES[:3] + error_lines * 2)
+        self.assertEqual(summary['origin_errors'], 2)
+
+    def test_request_failed_line_alone_is_not_an_origin_error(self):
+        request_failed = [line for line in CONSOLE_LINES if 'Request failed' in line]
+        summary = self.analyze(CONSOLE_LINES[:1] + request_failed)
+        self.assertEqual(summary['origin_errors'], 0)
+
+    def test_quick_tunnel_url(self):
+        lines = [
+            '2024-12-10T08:00:00Z INF Requesting new quick Tunnel on trycloudflare.com...',
+            '2024-12-10T08:00:01Z INF |  https://abc-def-ghi.trycloudflare.com                  |',
+        ]
+        summary = self.analyze(lines)
+        self.assertEqual(summary['url'], 'https://abc-def-ghi.trycloudflare.com')
+        self.assertEqual(summary['starts'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
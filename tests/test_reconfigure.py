@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# reconfigure的测试: 在临时目录中模拟 /etc/systemd/system，检查drop-in的生成和变更检测
+# 运行: python -m pytest tests 或 python -m unittest discover tests
+
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cloudflared
+
+BIN_PATH = "/usr/local/bin/cloudflared"
+SERVICE = "cloudflared-web"
+
+class ReconfigureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.unit_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.unit_dir)
+        self.log_path = os.path.join(self.unit_dir, "cloudflared-web.log")
+        # 与reconcile中profile生成的单元相同
+        settings = cloudflared.build_service_settings(BIN_PATH, "127.0.0.1:8080", self.log_path,
+                                                      ['--protocol', 'http2'])
+        with open(os.path.join(self.unit_dir, SERVICE + ".service"), 'w') as f:
+            f.write(cloudflared.render_unit(settings))
+
+        self.commands = []
+        patches = [
+            mock.patch.object(cloudflared, 'get_unit_path',
+                              lambda name: os.path.join(self.unit_dir, name + ".service")),
+            mock.patch.object(cloudflared, 'get_service_status', lambda name: "STOPPED"),
+            mock.patch.object(cloudflared.subprocess, 'run', self.fake_run),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_run(self, args, **kwargs):
+        self.commands.append(args)
+        return subprocess.CompletedProcess(args, 0, b'', b'')
+
+    def dropin_path(self):
+        return cloudflared.get_dropin_path(SERVICE)
+
+    def test_url_change_keeps_other_arguments(self):
+        result = cloudflared.reconfigure_service_linux(SERVICE, local_addr="127.0.0.1:9090")
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['changed'], ['ExecStart'])
+        self.assertIn(['systemctl', 'daemon-reload'], self.commands)
+
+        argv = cloudflared.read_exec_start(SERVICE)
+        self.assertEqual(argv, [BIN_PATH, 'tunnel', '--url', '127.0.0.1:9090', '--logfile', self.log_path,
+                                '--no-autoupdate', '--protocol', 'http2'])
+        with open(self.dropin_path(), 'r') as f:
+            self.assertIn("ExecStart=\n", f.read())
+
+    def test_log_change_updates_output_settings(self):
+        new_log = os.path.join(self.unit_dir, "new.log")
+        result = cloudflared.reconfigure_service_linux(SERVICE, log_path=new_log)
+        self.assertEqual(sorted(result['changed']),
+                         ['ExecStart', 'StandardError', 'StandardOutput'])
+        settings = cloudflared.read_unit_settings(SERVICE)
+        self.assertEqual(settings['StandardOutput'], "append:" + new_log)
+        argv = shlex.split(settings['ExecStart'])
+        self.assertEqual(cloudflared.get_option_value(argv, '--logfile'), new_log)
+        self.assertEqual(argv[-2:], ['--protocol', 'http2'])
+
+    def test_unchanged_address_writes_nothing(self):
+        result = cloudflared.reconfigure_service_linux(SERVICE, local_addr="127.0.0.1:8080")
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['changed'], [])
+        self.assertFalse(os.path.exists(self.dropin_path()))
+        self.assertEqual(self.commands, [])
+
+    def test_option_with_equals_sign_is_replaced_in_place(self):
+        argv = [BIN_PATH, 'tunnel', '--url=127.0.0.1:8080', '--protocol', 'quic']
+        self.assertEqual(cloudflared.set_option_value(argv, '--url', '127.0.0.1:9090'),
+                         [BIN_PATH, 'tunnel', '--url=127.0.0.1:9090', '--protocol', 'quic'])
+        self.assertEqual(cloudflared.set_option_value(argv, '--logfile', '/var/log/x.log'),
+                         [BIN_PATH, 'tunnel', '--logfile', '/var/log/x.log', '--url=127.0.0.1:8080',
+                          '--protocol', 'quic'])
+
+if __name__ == '__main__':
+    unittest.main()